@@ -0,0 +1,63 @@
+"""
+Import time of the compute and instrument modules, each one in a fresh
+interpreter (what a scan or reconstruction worker pays on start up). None of
+them may load the display stack (imported by backends on the first plot) nor
+pyvisa (imported when a real instrument is opened).
+
+    python benchmarks/bench_import.py [--target SECONDS] [--repeat N] [module ...]
+
+Exits with status 1 when a module is over the target or loads an optional module.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+src = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+modules = ('usrt', 'iterative', 'sweep', 'geometry', 'instruments', 'osctck', 'rotmcESP', 'orchestrator', 'utils', 'quicklook', 'averaging', 'catalog')
+lazy = ('matplotlib', 'IPython', 'tqdm', 'pyvisa')
+
+probe = """
+import json, sys, time
+t0 = time.perf_counter()
+import numpy
+t1 = time.perf_counter()
+import {0}
+t2 = time.perf_counter()
+print(json.dumps({{'numpy': t1 - t0, 'module': t2 - t1, 'loaded': [m for m in {1!r} if m in sys.modules]}}))
+"""
+
+
+def importTime(module:str, repeat:int=3):
+    '''(best import time of module after numpy, best import time of numpy, optional modules it loaded), s'''
+    best = None
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', probe.format(module, lazy)], cwd=src,
+                             capture_output=True, text=True, check=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        if best is None or r['module'] < best['module']:
+            best = r
+    return best['module'], best['numpy'], best['loaded']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('modules', nargs='*', default=modules)
+    parser.add_argument('--target', type=float, default=0.5, help='max import time of each module after numpy, s (default: 0.5)')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    failed = False
+    print("{0:<14} {1:>10} {2:>10}  {3}".format("module", "import ms", "numpy ms", "optional modules"))
+    for module in args.modules:
+        t, tNumpy, loaded = importTime(module, args.repeat)
+        over = t > args.target or loaded
+        failed = failed or over
+        print("{0:<14} {1:10.1f} {2:10.1f}  {3}{4}".format(module, 1e3*t, 1e3*tNumpy, ','.join(loaded) or '-', '  FAIL' if over else ''))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
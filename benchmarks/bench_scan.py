@@ -0,0 +1,129 @@
+"""
+End-to-end scan benchmark on the simulated TDS2024 + ESP300 rig (src/simulated.py):
+per-angle scan time, bytes on the buses and reconstruction time, for the
+notebook loop (one VISA session per call) and for the pipelined ScanOrchestrator.
+
+    python benchmarks/bench_scan.py --na 12 36 --avg 1 16 128 --nx 64 128 256
+
+With --trace DIR every scan is traced (src/tracing.py): a summary of commands,
+sleeps and compute is printed and DIR/<mode>_na<Na>_avg<nAvg>.trace.json can be
+opened in chrome://tracing or ui.perfetto.dev.
+With --snr TARGET two scans with SNR-adaptive averaging (src/averaging.py) are
+added; the second one reuses the averaging counts learned by the first.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import simulated
+import tracing
+from osctck import Osctck
+from rotmcESP import RotmcESP
+from orchestrator import ScanOrchestrator
+from usrt import usrt, UsrtStream
+from averaging import AveragingSchedule
+
+
+Rs = 42.625e-3
+vs = 1480
+dx = 0.08e-3
+
+
+def makeInstruments(nAvg, vel):
+    osc = Osctck('SIM::TDS2024::INSTR')
+    osc.config(channels = (1,), triggerSource = 'EXT', triggerLevel = -0.4, triggerSlope = 'FALL',
+               triggerMode = 'NORM', triggerCoup = 'AC', acquisition = nAvg, vAutoScale = False)
+    rot = RotmcESP('SIM::ESP300::INSTR')
+    rot.config(axis = 2, vel = vel, direction = '+', setOrigin = True)
+    return osc, rot
+
+
+def busTotals(rig):
+    return {'scopeBytes': rig.scope.bytesRead + rig.scope.bytesWritten, 'scopeCmds': rig.scope.nCommands,
+            'stageBytes': rig.stage.bytesRead + rig.stage.bytesWritten, 'stageCmds': rig.stage.nCommands}
+
+
+def notebookScan(Na, nAvg, vel):
+    """Loop of the Tomography Routine notebook"""
+    osc, rot = makeInstruments(nAvg, vel)
+    step = 360/Na
+    ltMeas = []
+    for i in range(Na):
+        meas = osc()
+        ltMeas.append(meas[1])
+        rot(reference = 'REL', rotAngle = step)
+    return meas[0], np.array(ltMeas)
+
+
+def orchestratedScan(Na, nAvg, vel, pt, nx, schedule=None):
+    osc, rot = makeInstruments(nAvg, vel)
+    stream = UsrtStream(pt, tAxis(), 1e-5, 5e6, vs, nx, dx, Rs, 360, Na=Na)
+    with tempfile.TemporaryDirectory() as scanDir:
+        orc = ScanOrchestrator(osc, rot, np.arange(Na)*360/Na, scanDir, stream, schedule=schedule)
+        orc.runSync()
+        t, sino, _ = orc.getSinogram()
+    return t, sino, orc.getTimings()
+
+
+def tAxis():
+    rig = simulated.getRig()
+    xze, xin = rig.scope._xPreamble()
+    return xze + np.arange(2500)*xin
+
+
+def impulseResponse():
+    return simulated.SimRig(absorbers=((0, 0, 1.0),)).signal(np.arange(2500)*4e-9 - 200e-9 + 2*Rs/vs, 0)
+
+
+def run(nas, avgs, nxs, trigFreq, vel, traceDir=None, targetSNR=None):
+    pt = impulseResponse()
+    print("{0:>14} {1:>4} {2:>5} {3:>12} {4:>12} {5:>12} {6:>10}".format(
+        'mode', 'Na', 'nAvg', 's/angle', 'scope B/ang', 'stage B/ang', 'cmds/ang'))
+    for Na in nas:
+        for nAvg in avgs:
+            modes = ('notebook', 'orchestrator') + (('adaptive', 'adaptive 2nd') if targetSNR else ())
+            schedule = AveragingSchedule(targetSNR) if targetSNR else None
+            for mode in modes:
+                simulated.setRig(simulated.SimRig(trigFreq=trigFreq))
+                tracer = tracing.enable() if traceDir else None
+                t1 = time.perf_counter()
+                if mode == 'notebook':
+                    t, sino = notebookScan(Na, nAvg, vel)
+                elif mode == 'orchestrator':
+                    t, sino, timings = orchestratedScan(Na, nAvg, vel, pt, nxs[0])
+                else:   #the second adaptive scan reuses the averaging counts learned by the first one
+                    t, sino, timings = orchestratedScan(Na, nAvg, vel, pt, nxs[0], schedule)
+                dt = time.perf_counter() - t1
+                tracing.disable()
+                bus = busTotals(simulated.getRig())
+                print("{0:>14} {1:>4} {2:>5} {3:>12.4f} {4:>12.0f} {5:>12.0f} {6:>10.1f}".format(
+                    mode, Na, nAvg, dt/Na, bus['scopeBytes']/Na, bus['stageBytes']/Na,
+                    (bus['scopeCmds'] + bus['stageCmds'])/Na))
+                if tracer is not None:
+                    tracer.printSummary(top=10)
+                    tracer.saveChromeTrace(os.path.join(traceDir, "{0}_na{1}_avg{2}.trace.json".format(mode.replace(' ', '_'), Na, nAvg)))
+
+            for nx in nxs:
+                t1 = time.perf_counter()
+                usrt(sino, pt, t, 1e-5, 5e6, vs, nx, dx, Rs, 360, False)
+                print("{0:>14} {1:>4} {2:>5} reconstruction nx={3}: {4:.3f} s".format(
+                    'usrt', Na, nAvg, nx, time.perf_counter() - t1))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--na', type=int, nargs='+', default=[12, 36])
+    parser.add_argument('--avg', type=int, nargs='+', default=[1, 16, 128])
+    parser.add_argument('--nx', type=int, nargs='+', default=[64, 128, 256])
+    parser.add_argument('--trig', type=float, default=1000, help='trigger rate of the simulated laser, Hz')
+    parser.add_argument('--vel', type=float, default=100, help='stage velocity, °/s')
+    parser.add_argument('--trace', metavar='DIR', help='trace every scan and save the timelines in DIR')
+    parser.add_argument('--snr', type=float, help='also run two SNR-adaptive scans with this target SNR')
+    args = parser.parse_args()
+    if args.trace:
+        os.makedirs(args.trace, exist_ok=True)
+    run(args.na, args.avg, args.nx, args.trig, args.vel, args.trace, args.snr)
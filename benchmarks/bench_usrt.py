@@ -0,0 +1,87 @@
+"""
+Benchmark of the usrt backprojection engine against the original per-pixel
+np.interp loop, using the geometry of the Tomography Routine notebook.
+
+    python benchmarks/bench_usrt.py [Na] [workers]
+"""
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from usrt import createImagegrid2D, backprojectAngles, backproject
+
+
+Rs = 42.625e-3          # distance between the transducer and the center of the axis of rotation
+arc = 360               # arc of circumference [°]
+vs = 1480               # speed of sound in the environment [m/s]
+nx = 256                # number of pixels per side of the image grid
+dx = 0.08e-3            # pixel size [m]
+Nt = 2500               # record length of the TDS2024
+t = (40e-6 + np.arange(Nt)*40e-9).astype(np.float32)
+
+
+def legacyBackprojection(psi, t, vs, nx, dx, Rs, arc, nAngles=None):
+    """Inner loop of the original usrt, one np.interp call per pixel."""
+    Na = psi.shape[0]
+    tita = (np.linspace(0,arc*np.pi/180,Na+1)[0:-1]).astype(np.float32)
+    dtita = (arc/Na)*np.pi/180
+    rj = createImagegrid2D(nx,dx)
+    N = rj.shape[1]
+    F = np.zeros(N, dtype=np.float32)
+    for i2 in range(0, Na if nAngles is None else nAngles):
+        rsx = Rs*np.cos(tita[i2]); rsy = Rs*np.sin(tita[i2])
+        for i1 in range(0,N):
+            ta = 2/vs*((rsx-rj[0,i1])*np.cos(tita[i2])+(rsy-rj[1,i1])*np.sin(tita[i2]))
+            F[i1] = F[i1] + np.interp(ta, t, psi[i2]) * dtita
+    return F
+
+
+def vectorBackprojection(psi, t, vs, nx, dx, Rs, arc):
+    Na = psi.shape[0]
+    tita = np.linspace(0,arc*np.pi/180,Na+1)[0:-1]
+    wtita = np.full(Na, (arc/Na)*np.pi/180)
+    return backprojectAngles(psi, t, tita, wtita, createImagegrid2D(nx,dx), vs, Rs)
+
+
+def parallelBackprojection(psi, t, vs, nx, dx, Rs, arc, workers):
+    Na = psi.shape[0]
+    tita = np.linspace(0,arc*np.pi/180,Na+1)[0:-1]
+    wtita = np.full(Na, (arc/Na)*np.pi/180)
+    return backproject(psi, t, tita, wtita, createImagegrid2D(nx,dx), vs, Rs, workers=workers)
+
+
+def main(Na=36, workers=os.cpu_count()):
+    rng = np.random.default_rng(0)
+    psi = rng.standard_normal((Na, Nt)).astype(np.float32)
+
+    # Correctness on a small grid, where the legacy loop is affordable
+    Fref = legacyBackprojection(psi, t, vs, 32, 4*dx, Rs, arc)
+    Fnew = vectorBackprojection(psi, t, vs, 32, 4*dx, Rs, arc)
+    err = np.max(np.abs(Fref - Fnew))/np.max(np.abs(Fref))
+    print("nx=32 max relative error: {0:.2e}".format(err))
+
+    # Legacy timing on a couple of angles, extrapolated to the full scan
+    nLeg = 2
+    t1 = time.perf_counter()
+    legacyBackprojection(psi, t, vs, nx, dx, Rs, arc, nAngles=nLeg)
+    tLegacy = (time.perf_counter() - t1)*Na/nLeg
+
+    t1 = time.perf_counter()
+    vectorBackprojection(psi, t, vs, nx, dx, Rs, arc)
+    tVector = time.perf_counter() - t1
+
+    print("nx={0}, Na={1}".format(nx, Na))
+    print("legacy (extrapolated): {0:8.2f} s".format(tLegacy))
+    print("vectorized:            {0:8.2f} s".format(tVector))
+    print("speedup:               {0:8.1f}x".format(tLegacy/tVector))
+
+    t1 = time.perf_counter()
+    parallelBackprojection(psi, t, vs, nx, dx, Rs, arc, workers)
+    tParallel = time.perf_counter() - t1
+    print("{0} threads:{1:>15.2f} s".format(workers, tParallel))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,62 @@
+"""
+Regression check of SNR-adaptive averaging on the simulated rig: two scans
+back to back with the same AveragingSchedule, the second one using the counts
+learned by the first (including angles that learned a count of 1).
+
+    python benchmarks/check_adaptive.py [--na NA] [--snr TARGET]
+
+Exits with status 1 when a scan fails or misses angles.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import simulated
+from osctck import Osctck
+from rotmcESP import RotmcESP
+from orchestrator import ScanOrchestrator
+from averaging import AveragingSchedule
+
+
+def adaptiveScan(angles, schedule):
+    osc = Osctck('SIM::TDS2024::INSTR')
+    osc.config(channels = (1,), triggerSource = 'EXT', triggerLevel = -0.4, triggerSlope = 'FALL',
+               triggerMode = 'NORM', triggerCoup = 'AC', acquisition = 16, vAutoScale = False)
+    rot = RotmcESP('SIM::ESP300::INSTR')
+    rot.config(axis = 2, vel = 200, direction = '+', setOrigin = True)
+    with tempfile.TemporaryDirectory() as scanDir:
+        return ScanOrchestrator(osc, rot, angles, scanDir, schedule=schedule).runSync()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--na', type=int, default=12)
+    parser.add_argument('--snr', type=float, default=20)
+    args = parser.parse_args(argv)
+
+    # Strong absorbers and low noise, so most angles learn a count of 1
+    simulated.setRig(simulated.SimRig(absorbers=((1e-3, 2e-3, 2.0), (-2e-3, 0, 1.0)), noise=0.005,
+                                      trigFreq=5000, serialLatency=1e-4))
+    angles = np.arange(args.na)*360/args.na
+    schedule = AveragingSchedule(args.snr)
+    ok = True
+    for scan in ('1st', '2nd'):
+        try:
+            completed = adaptiveScan(angles, schedule)
+        except Exception as e:
+            print("{0} scan failed: {1!r}".format(scan, e))
+            return 1
+        counts = schedule.getCounts()
+        print("{0} scan: {1}/{2} angles, counts {3}".format(scan, len(completed), args.na, sorted(set(counts.values()))))
+        ok = ok and len(completed) == args.na and len(counts) == args.na
+    if 1 not in schedule.getCounts().values():
+        print("No angle learned a count of 1, the check did not cover it")
+        ok = False
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import json
+import os
+import numpy as np
+
+
+levels = (1, 4, 16, 64, 128)     #Averaging counts of Osctck.setAcquisition
+
+
+def estimateNoise(values, lsb:float=0):
+    """
+    Std of the white noise of a trace, from the median absolute deviation of its
+    second differences (robust to the pulses, which change slowly between samples).
+    lsb: volts per code; the estimate is not taken below the quantization noise lsb/sqrt(12)
+    """
+    d = np.diff(np.asarray(values, dtype=float), 2)
+    sigma = 1.4826*np.median(np.abs(d - np.median(d)))/np.sqrt(6)
+    return max(float(sigma), lsb/np.sqrt(12))
+
+
+def estimatePeak(values, noise:float=0):
+    """
+    Amplitude of the signal: max |values - baseline|, with the median as baseline,
+    less the largest value expected from noise alone (about noise*sqrt(2*ln(Np)))
+    """
+    values = np.asarray(values, dtype=float)
+    peak = float(np.max(np.abs(values - np.median(values))))
+    return max(peak - noise*np.sqrt(2*np.log(len(values))), 0.0)
+
+
+def neededAveraging(peak:float, noise:float, targetSNR:float):
+    '''Averages that bring peak/(noise/sqrt(count)) to targetSNR (not rounded to a level)'''
+    if peak <= 0:
+        return np.inf
+    return (targetSNR*noise/peak)**2
+
+
+def chooseAveraging(needed:float, levels:tuple=levels):
+    '''Smallest count of levels not below needed, the largest one if none is'''
+    for n in levels:
+        if n >= needed:
+            return n
+    return levels[-1]
+
+
+class AveragingSchedule(object):
+    '''Averaging count of each angle of a scan, chosen from the SNR of the measured traces
+
+    Angles without a count are first measured with a single shot to choose it.
+    Each measurement updates the count of its angle, so a schedule saved to a file
+    lets the next scan of the same sample skip the single shots.
+    '''
+
+    def __init__(self, targetSNR:float=50, path:str=None, levels:tuple=levels, channels:tuple=None):
+        """
+        targetSNR: peak signal over noise std wanted for every angle
+        path: JSON file where the counts are kept between scans (optional)
+        levels: allowed averaging counts, in increasing order
+        channels: channels considered (all the channels of the waveform by default)
+        """
+        self._targetSNR = targetSNR
+        self._path = path
+        self._levels = tuple(levels)
+        self._channels = channels
+        self._counts = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self._counts = dict((float(angle), int(n)) for angle, n in json.load(f)['counts'].items())
+
+
+    def get(self, angle:float):
+        '''Averaging count of the angle, None if it has to be chosen from a single shot'''
+        return self._counts.get(float(angle))
+
+
+    def getPath(self):
+        return self._path
+
+
+    def getCounts(self):
+        return dict(self._counts)
+
+
+    def needed(self, waveform):
+        """
+        Averages needed by the OscWaveform (its worst channel), from the noise of a single
+        shot equivalent. None when the noise left is below half a code: the quantization
+        hides it, so the trace only shows that its own count was enough.
+        """
+        nAcq = waveform.numAcq if waveform.numAcq else 1
+        channels = waveform.channels if self._channels is None else self._channels
+        needed = 0
+        for ch in channels:
+            i = waveform.channels.index(ch)
+            values = waveform.getVolts(ch)
+            noise = estimateNoise(values, waveform.ymu[i])
+            if nAcq > 1 and noise < waveform.ymu[i]/2:
+                return None
+            needed = max(needed, neededAveraging(estimatePeak(values, noise), noise*np.sqrt(nAcq), self._targetSNR))
+        return needed
+
+
+    def choose(self, waveform):
+        '''Averaging count for the SNR of the OscWaveform'''
+        needed = self.needed(waveform)
+        return waveform.numAcq if needed is None else chooseAveraging(needed, self._levels)
+
+
+    def update(self, angle:float, waveform):
+        '''Re-estimates the count of the angle from its last measurement. It only goes down
+        when half the lower count is enough, so estimates near a threshold do not toggle it.'''
+        needed = self.needed(waveform)
+        if needed is None:
+            needed = waveform.numAcq
+        n = chooseAveraging(needed, self._levels)
+        old = self.get(angle)
+        if old is not None and n < old and needed > n/2:
+            n = old
+        self._counts[float(angle)] = n
+
+
+    def save(self, path:str=None):
+        path = self._path if path is None else path
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'targetSNR': self._targetSNR, 'levels': self._levels,
+                       'counts': dict((repr(angle), n) for angle, n in sorted(self._counts.items()))}, f, indent=1)
+        os.replace(path + '.tmp', path)
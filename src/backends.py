@@ -0,0 +1,49 @@
+"""
+Optional display backends (matplotlib, IPython, tqdm), imported on first use so
+the compute and instrument modules load without a display stack.
+"""
+
+
+def pyplot():
+    '''matplotlib.pyplot, imported on the first plot'''
+    from matplotlib import pyplot as plt
+    return plt
+
+
+def clearOutput(wait:bool=True):
+    '''Clears the output of the notebook cell, nothing outside IPython'''
+    try:
+        from IPython.display import clear_output
+    except ImportError:
+        return
+    clear_output(wait=wait)
+
+
+class _NoProgress(object):
+
+    def __init__(self, total=None):
+        pass
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, excType, excValue, traceback):
+        pass
+
+
+    def update(self, n=1):
+        pass
+
+
+def progressBar(total:int, enabled:bool=True):
+    '''tqdm progress bar, or an object with the same update/with interface that shows nothing
+    when disabled or when tqdm is not installed'''
+    if enabled:
+        try:
+            from tqdm import tqdm
+        except ImportError:
+            return _NoProgress(total)
+        return tqdm(total=total)
+    return _NoProgress(total)
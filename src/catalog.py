@@ -0,0 +1,212 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+
+_columns = ('path', 'kind', 'folder', 'date', 'angle', 'nAngles', 'recordLength', 'channels',
+            'triggerSource', 'triggerLevel', 'acquisition', 'temperature', 'metadata', 'mtime', 'size')
+
+
+def _fileStamp(path):
+    '''(mtime, size) that changes whenever the measurement changes. For a MeasStore folder, those of its index.'''
+    if os.path.isdir(path):
+        path = os.path.join(path, 'index.f8')
+        if not os.path.exists(path):
+            return 0.0, 0
+    st = os.stat(path)
+    return st.st_mtime, st.st_size
+
+
+def _dateFromPath(path):
+    '''Date of the "Mediciones dd-mm-yyyy" folder containing path, or that of its last modification'''
+    m = re.search(r'Mediciones (\d{2})-(\d{2})-(\d{4})', path)
+    if m:
+        return "{2}-{1}-{0}".format(*m.groups())
+    return time.strftime('%Y-%m-%d', time.localtime(_fileStamp(path)[0]))
+
+
+def isTrace(path):
+    '''Text trace written by utils.saveAngleMeas: "Medicion_en_<angle>°" name or its "# [seg.]" header'''
+    if re.search(r'Medicion_en_-?[\d.]+°', os.path.basename(path)):
+        return True
+    try:
+        with open(path, 'rb') as f:
+            return f.readline(64).startswith(b'# [seg.]')
+    except OSError:
+        return False
+
+
+def describeFile(path):
+    """
+    Metadata of a measurement file: legacy text trace (np.savetxt), .npz sinogram
+    of the Tomography Routine or MeasStore folder. Returns a dict of catalog columns.
+    """
+    info = dict.fromkeys(_columns)
+    info['path'] = path
+    info['folder'] = os.path.basename(os.path.dirname(path))
+    info['date'] = _dateFromPath(path)
+    info['mtime'], info['size'] = _fileStamp(path)
+    m = re.search(r'Medicion_en_(-?[\d.]+)°', path)
+    if m:
+        info['angle'] = float(m.group(1))
+
+    if os.path.isdir(path):
+        info['kind'] = 'meas'
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        info['channels'] = ','.join(str(ch) for ch in meta['channels'])
+        info['recordLength'] = meta['nPoints']
+        info['nAngles'] = info['size']//(8*(4 + 3*len(meta['channels'])))
+        extra = meta.get('metadata', {})
+        for key in ('triggerSource', 'triggerLevel', 'acquisition', 'temperature'):
+            info[key] = extra.get(key)
+        info['metadata'] = json.dumps(extra, default=str)
+    elif path.endswith('.npz'):
+        info['kind'] = 'npz'
+        with np.load(path) as data:
+            if 'Sinogram' in data:
+                info['nAngles'], info['recordLength'] = data['Sinogram'].shape
+            info['metadata'] = json.dumps({key: list(data[key].shape) for key in data.files})
+    elif isTrace(path):
+        info['kind'] = 'txt'
+        with open(path, errors='replace') as f:
+            info['recordLength'] = sum(1 for line in f if line.strip() and not line.startswith('#'))
+        info['nAngles'] = 1
+    else:
+        raise ValueError("Not a measurement: {0}".format(path))
+    return info
+
+
+class MeasCatalog(object):
+    '''SQLite index of the measurements saved under the Mediciones folder'''
+
+    def __init__(self, root:str="Mediciones", dbPath:str=None):
+        """
+        dbPath: database file, root/.catalog/catalog.sqlite by default (in a hidden
+        folder, so the scripts that walk root only find measurement folders)
+        """
+        self._root = root
+        self._dbPath = os.path.join(root, '.catalog', 'catalog.sqlite') if dbPath is None else dbPath
+        os.makedirs(os.path.dirname(os.path.abspath(self._dbPath)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Stores are appended from worker threads (e.g. the persist stage of ScanOrchestrator)
+        self._db = sqlite3.connect(self._dbPath, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS measurements (path TEXT PRIMARY KEY, kind TEXT, folder TEXT, date TEXT, "
+                         "angle REAL, nAngles INTEGER, recordLength INTEGER, channels TEXT, triggerSource TEXT, "
+                         "triggerLevel REAL, acquisition INTEGER, temperature REAL, metadata TEXT, mtime REAL, size INTEGER)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS measDate ON measurements (date)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS measFolder ON measurements (folder)")
+        self._db.commit()
+
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+    def add(self, path:str, **fields):
+        '''Indexes (or updates) a measurement. fields override what is read from the file (e.g. temperature).'''
+        info = describeFile(path)
+        info.update(fields)
+        self._upsert([info])
+
+
+    def _upsert(self, infos):
+        rows = [tuple(info.get(col) for col in _columns) for info in infos]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO measurements ({0}) VALUES ({1})".format(
+                ','.join(_columns), ','.join('?'*len(_columns))), rows)
+            self._db.commit()
+
+
+    def listMeasurements(self):
+        '''Measurement files (text traces and .npz) and MeasStore folders under root'''
+        paths = []
+        for dirPath, dirNames, fileNames in os.walk(self._root):
+            dirNames[:] = [d for d in dirNames if not d.startswith('.')]      #The database folder
+            for d in list(dirNames):
+                if d.endswith('.meas'):
+                    paths.append(os.path.join(dirPath, d))
+                    dirNames.remove(d)
+            for f in fileNames:
+                path = os.path.join(dirPath, f)
+                if f.endswith('.npz') or isTrace(path):
+                    paths.append(path)
+        return paths
+
+
+    def reindex(self, workers:int=4):
+        """
+        Incremental re-index of root: only new or modified files are read, in a
+        pool of worker processes. Entries of deleted files are removed.
+        Returns the number of files (re)indexed.
+        """
+        with self._lock:
+            known = dict((path, (mtime, size)) for path, mtime, size in self._db.execute("SELECT path, mtime, size FROM measurements"))
+        paths = self.listMeasurements()
+        changed = [p for p in paths if known.get(p) != _fileStamp(p)]
+        gone = set(known) - set(paths)
+        if gone:
+            with self._lock:
+                self._db.executemany("DELETE FROM measurements WHERE path = ?", [(p,) for p in gone])
+                self._db.commit()
+        if not changed:
+            return 0
+
+        if workers > 1 and len(changed) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                infos = list(executor.map(_describeOrNone, changed, chunksize=16))
+        else:
+            infos = [_describeOrNone(p) for p in changed]
+        with self._lock:
+            old = dict((row[0], row) for row in self._db.execute(
+                "SELECT path, temperature, triggerSource, triggerLevel, acquisition FROM measurements"))
+        for info in infos:
+            if info is not None and info['path'] in old:
+                # Values given to add() that the file itself does not hold are kept
+                _, temperature, source, level, acquisition = old[info['path']]
+                for key, value in (('temperature', temperature), ('triggerSource', source),
+                                   ('triggerLevel', level), ('acquisition', acquisition)):
+                    if info[key] is None:
+                        info[key] = value
+        self._upsert([info for info in infos if info is not None])
+        return len(changed)
+
+
+    def find(self, dateFrom:str=None, dateTo:str=None, minAngles:int=None, **equal):
+        """
+        Measurements matching all the criteria, as a list of dicts.
+        dateFrom, dateTo: 'YYYY-MM-DD' limits (inclusive)
+        minAngles: minimum number of angles
+        equal: column=value conditions, e.g. folder='Campo', kind='npz', recordLength=2500
+        """
+        where = []
+        params = []
+        if dateFrom is not None:
+            where.append("date >= ?"); params.append(dateFrom)
+        if dateTo is not None:
+            where.append("date <= ?"); params.append(dateTo)
+        if minAngles is not None:
+            where.append("nAngles >= ?"); params.append(minAngles)
+        for key, value in equal.items():
+            if key not in _columns:
+                raise ValueError("Unknown catalog column: {0}".format(key))
+            where.append("{0} = ?".format(key)); params.append(value)
+        sql = "SELECT {0} FROM measurements".format(','.join(_columns))
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY date, path"
+        with self._lock:
+            return [dict(zip(_columns, row)) for row in self._db.execute(sql, params).fetchall()]
+
+
+def _describeOrNone(path):
+    try:
+        return describeFile(path)
+    except (OSError, ValueError, KeyError):
+        return None      #Not a measurement (or still being written)
@@ -0,0 +1,99 @@
+import threading
+import time
+import numpy as np
+
+
+class PositionLog(object):
+    '''Background thread that timestamps the TP readings of a moving axis'''
+
+    def __init__(self, rot, axis:int, period:float=0.02):
+        self._rot = rot
+        self._axis = axis
+        self._period = period
+        self._stopEvent = threading.Event()
+        self._lock = threading.Lock()
+        self.times = []
+        self.positions = []
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+
+
+    def start(self):
+        self._thread.start()
+
+
+    def stop(self):
+        self._stopEvent.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+    def read(self):
+        '''Time (midpoint of the query) and position of one TP reading'''
+        t0 = time.monotonic()
+        pos = float(self._rot.getPosition(self._axis))
+        t1 = time.monotonic()
+        with self._lock:
+            self.times.append((t0 + t1)/2)
+            self.positions.append(pos)
+        return pos
+
+
+    def last(self):
+        with self._lock:
+            return self.positions[-1]
+
+
+    def positionAt(self, t):
+        with self._lock:
+            return np.interp(t, self.times, self.positions)
+
+
+    def _worker(self):
+        while not self._stopEvent.wait(self._period):
+            self.read()
+
+
+def flyScan(osc, rot, axis:int=2, arc:float=360, vel:float=5, direction:str='+', pollPeriod:float=0.02, onShot=None):
+    """
+    Continuous-rotation ("fly") scan: the axis turns at constant velocity while the
+    scope acquires back to back. Each acquisition is timestamped and its angle is
+    interpolated from the TP readings taken meanwhile, so the scan is limited by the
+    trigger rate instead of the settle time of each step.
+    osc: configured Osctck. Averaging blurs each shot over vel*(acquisition time).
+    rot: RotmcESP
+    axis: axis of the rotation stage
+    arc: rotation covered by the scan, °
+    vel: velocity, °/s
+    direction: "+" or "-"
+    pollPeriod: time between TP readings, s
+    onShot: called as onShot(angle, values) after each acquisition (e.g. UsrtStream.push)
+    Returns (t [Nt,], sinogram [Na, Nt], angles [Na,] in ° from the start position, sorted)
+    """
+    traces = []
+    tAcq = []
+    log = PositionLog(rot, axis, pollPeriod)
+    osc.open()
+    rot.initComm()
+    try:
+        rot.setVelocity(axis, vel)
+        pos0 = log.read()
+        rot.moveIndefinitely(axis, direction)
+        log.start()
+        while abs(log.last() - pos0) < arc:
+            waveform = osc.acquireRaw()
+            values = waveform.toArray()
+            traces.append(values[1])
+            tAcq.append(sum(waveform.tAcq)/2)
+            if onShot is not None:
+                onShot(abs(log.positionAt(tAcq[-1]) - pos0), values)
+    finally:
+        log.stop()
+        rot.stopMotion(axis)
+        log.read()
+        osc.close()
+        rot.closeComm()
+
+    angles = np.abs(log.positionAt(np.array(tAcq)) - pos0)
+    keep = angles < arc
+    order = np.argsort(angles[keep])
+    return values[0], np.array(traces)[keep][order], angles[keep][order]
@@ -0,0 +1,126 @@
+import os
+import json
+import hashlib
+import numpy as np
+import scipy.sparse as sp
+
+from usrt import createImagegrid2D, interpTable, filterSinogram
+
+
+class ScanGeometry(object):
+    '''Backprojection operator of a fixed scan geometry, cached on disk as a sparse matrix'''
+
+    _version = 1
+
+    def __init__(self, Rs:float, arc:float, Na:int, t, nx:int, dx:float, vs:float, cacheDir:str=None, maxCacheBytes:int=2*1024**3):
+        """
+        Rs: distance between the transducer and the rotation axis of the sample
+        arc: circunference arc [°]
+        Na: number of angles
+        t: uniform time axis [Nt,]
+        nx = number of pixels per side of the image grid
+        dx = size of the pixel, m
+        vs: speed of sound of the medium, m/s
+        cacheDir: folder of the operator cache (default: $USRT_CACHE_DIR or ~/.cache/usrt)
+        maxCacheBytes: size limit of the cache folder, older operators are evicted
+        """
+        t = np.asarray(t, dtype=np.float32)
+        self._Rs = float(Rs)
+        self._arc = float(arc)
+        self._Na = int(Na)
+        self._t0 = float(t[0])
+        self._dt = (float(t[-1]) - float(t[0]))/(len(t)-1)
+        self._t = t
+        self._nx = int(nx)
+        self._dx = float(dx)
+        self._vs = float(vs)
+        if cacheDir is None:
+            cacheDir = os.environ.get('USRT_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'usrt'))
+        self._cacheDir = cacheDir
+        self._maxCacheBytes = maxCacheBytes
+        self._A = None
+
+
+    def key(self):
+        params = {'Rs': self._Rs, 'arc': self._arc, 'Na': self._Na, 't0': self._t0, 'dt': self._dt,
+                  'Nt': len(self._t), 'nx': self._nx, 'dx': self._dx, 'vs': self._vs, 'version': self._version}
+        return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+    def cachePath(self):
+        return os.path.join(self._cacheDir, self.key() + '.npz')
+
+
+    def getAngles(self):
+        tita = np.linspace(0,self._arc*np.pi/180,self._Na+1)[0:-1]  # rad [Na, ]
+        return tita.astype(np.float32)
+
+
+    def getOperator(self):
+        """Sparse backprojection matrix [N, Na*Nt], F = A @ psi.ravel()"""
+        if self._A is None:
+            path = self.cachePath()
+            if os.path.exists(path):
+                self._A = sp.load_npz(path)
+                os.utime(path)    # mark as recently used
+            else:
+                self._A = self.buildOperator()
+                self.saveOperator(path)
+        return self._A
+
+
+    def buildOperator(self, chunkSize=1<<21):
+        Na, Nt = self._Na, len(self._t)
+        tita = self.getAngles()
+        dtita = np.float32((self._arc/Na)*np.pi/180)
+        rj = createImagegrid2D(self._nx, self._dx)
+        N = rj.shape[1]
+
+        # every pixel has exactly two samples per angle
+        indices = np.empty((N, 2*Na), dtype=np.int32)
+        data = np.empty((N, 2*Na), dtype=np.float32)
+        rowOffset = (np.arange(Na, dtype=np.int32)*Nt)[:, None]
+        nPix = max(1, chunkSize//Na)
+        for j0 in range(0, N, nPix):
+            i0, frac = interpTable(self._t, tita, rj[:, j0:j0+nPix], self._vs, self._Rs)
+            i0 += rowOffset
+            indices[j0:j0+nPix, 0::2] = i0.T
+            indices[j0:j0+nPix, 1::2] = i0.T + 1
+            data[j0:j0+nPix, 0::2] = (1 - frac.T)*dtita
+            data[j0:j0+nPix, 1::2] = frac.T*dtita
+        indptr = np.arange(N+1, dtype=np.int64)*(2*Na)
+        return sp.csr_matrix((data.ravel(), indices.ravel(), indptr), shape=(N, Na*Nt))
+
+
+    def saveOperator(self, path):
+        os.makedirs(self._cacheDir, exist_ok=True)
+        size = self._A.data.nbytes + self._A.indices.nbytes + self._A.indptr.nbytes
+        if size > self._maxCacheBytes:
+            return
+        self.evictCache(self._maxCacheBytes - size)
+        tmpPath = path + '.tmp.npz'
+        sp.save_npz(tmpPath, self._A, compressed=False)
+        os.replace(tmpPath, path)
+
+
+    def evictCache(self, maxBytes):
+        """Deletes the least recently used operators until the cache takes at most maxBytes"""
+        files = [os.path.join(self._cacheDir, f) for f in os.listdir(self._cacheDir) if f.endswith('.npz')]
+        files.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(f) for f in files)
+        for f in files:
+            if total <= maxBytes:
+                break
+            total -= os.path.getsize(f)
+            os.remove(f)
+
+
+    def backproject(self, psi):
+        """psi: filtered sinogram [Na, Nt] (see usrt.filterSinogram). Returns the image [nx, nx]"""
+        F = self.getOperator() @ np.ascontiguousarray(psi, dtype=np.float32).ravel()
+        return np.reshape(F, (self._nx, self._nx))
+
+
+    def reconstruct(self, sino, pt, Snoise, hfrec):
+        """Same image as usrt with this geometry, see usrt for the arguments"""
+        return self.backproject(filterSinogram(sino, pt, self._t, Snoise, hfrec, self._vs))
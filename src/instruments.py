@@ -0,0 +1,184 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import simulated
+import tracing
+
+
+class Device(object):
+    '''Session of one instrument, shared by every object of the process that uses it
+
+    Each command runs under the lock of the device, so a query is never split by a
+    command of another thread. Hold device.lock to keep a sequence of commands together:
+        with device.lock:
+            device.write("ACQ:STATE RUN")
+            ...
+    Commands to different devices do not wait for each other.
+    '''
+
+    def __init__(self, resource:str, session):
+        object.__setattr__(self, 'resource', resource)
+        object.__setattr__(self, 'session', session)
+        object.__setattr__(self, 'lock', threading.RLock())
+        object.__setattr__(self, 'state', {})      #Settings known to be in the instrument, shared by its users
+
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+    def __setattr__(self, name, value):
+        setattr(self.session, name, value)      #baud_rate, read_termination, ... belong to the session
+
+
+    def write(self, cmd, *args, **kwargs):
+        with self.lock:
+            return self.session.write(cmd, *args, **kwargs)
+
+
+    def query(self, cmd, *args, **kwargs):
+        with self.lock:
+            return self.session.query(cmd, *args, **kwargs)
+
+
+    def query_ascii_values(self, cmd, *args, **kwargs):
+        with self.lock:
+            return self.session.query_ascii_values(cmd, *args, **kwargs)
+
+
+    def query_binary_values(self, cmd, *args, **kwargs):
+        with self.lock:
+            return self.session.query_binary_values(cmd, *args, **kwargs)
+
+
+class InstrumentManager(object):
+    '''Owns the pyvisa ResourceManager and one Device per resource, and runs commands to several devices concurrently
+
+    Usage:
+        manager = instruments.getManager()
+        with Osctck(scope1) as osc1, Osctck(scope2) as osc2:
+            wf1, wf2 = manager.runConcurrently(osc1.acquireRaw, osc2.acquireRaw)
+    '''
+
+    def __init__(self, workers:int=8):
+        """
+        workers: threads of the pool of runConcurrently/submit
+        """
+        self._workers = workers
+        self._lock = threading.Lock()
+        self._devices = {}
+        self._refs = {}
+        self._rm = None
+        self._executor = None
+
+
+    def _openSession(self, resource):
+        '''"SIM::TDS2024::INSTR" and "SIM::ESP300::INSTR" are the instruments of the simulated rig (see simulated.getRig/setRig)'''
+        if resource.upper().startswith('SIM::TDS'):
+            return simulated.getRig().scope
+        if resource.upper().startswith('SIM::ESP'):
+            return simulated.getRig().stage
+        if self._rm is None:
+            import pyvisa       #only needed for the real instruments
+            self._rm = pyvisa.ResourceManager()
+        return self._rm.open_resource(resource)
+
+
+    def open(self, resource:str, cat:str='visa', configure=None):
+        """
+        Device of the resource, opened on the first call. Every open needs its release.
+        cat: tracing category of its commands ("usb", "serial", ...)
+        configure: called as configure(device) when the session is opened (baud rate, terminations, ...)
+        """
+        with self._lock:
+            device = self._devices.get(resource)
+            if device is None:
+                device = Device(resource, tracing.wrap(self._openSession(resource), cat))
+                if configure is not None:
+                    configure(device)
+                self._devices[resource] = device
+                self._refs[resource] = 0
+            self._refs[resource] += 1
+            return device
+
+
+    def release(self, resource:str):
+        '''Drops a reference to the device, closing its session with the last one'''
+        with self._lock:
+            self._refs[resource] -= 1
+            if self._refs[resource] > 0:
+                return
+            del self._refs[resource]
+            device = self._devices.pop(resource)
+        with device.lock:
+            device.session.close()
+
+
+    def getDevice(self, resource:str):
+        '''Open device of the resource, None if it is not open'''
+        with self._lock:
+            return self._devices.get(resource)
+
+
+    def listDevices(self):
+        with self._lock:
+            return list(self._devices)
+
+
+    def submit(self, fn, *args, **kwargs):
+        '''Runs fn(*args, **kwargs) in the pool of threads. Returns a concurrent.futures.Future.'''
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='instrument')
+        return self._executor.submit(fn, *args, **kwargs)
+
+
+    def runConcurrently(self, *calls):
+        """
+        Runs the calls (callables without arguments, e.g. osc.acquireRaw or
+        functools.partial(rot, 'ABS', 90)) at the same time and returns their
+        results in the same order. Calls to different devices take as long as
+        the slowest one. The first exception raised is raised again once all
+        the calls are done.
+        """
+        futures = [self.submit(call) for call in calls]
+        errors = [f.exception() for f in futures]
+        for e in errors:
+            if e is not None:
+                raise e
+        return [f.result() for f in futures]
+
+
+    def close(self):
+        '''Closes every session, the pool and the ResourceManager'''
+        with self._lock:
+            devices, self._devices = list(self._devices.values()), {}
+            self._refs = {}
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+        for device in devices:
+            with device.lock:
+                device.session.close()
+        if self._rm is not None:
+            self._rm.close()
+            self._rm = None
+
+
+_manager = None
+_managerLock = threading.Lock()
+
+
+def getManager():
+    '''InstrumentManager of the process, created on first use'''
+    global _manager
+    with _managerLock:
+        if _manager is None:
+            _manager = InstrumentManager()
+        return _manager
+
+
+def setManager(manager:InstrumentManager):
+    global _manager
+    with _managerLock:
+        _manager = manager
@@ -0,0 +1,239 @@
+import numpy as np
+
+from usrt import createImagegrid2D, interpTable, filterSinogram, wienerKernel
+import tracing
+
+
+class DelayOperator(object):
+    '''Matrix-free projection operator of the usrt geometry
+
+    forward(f) spreads each pixel value on the samples of its delay (the linear
+    interpolation weights of interpTable), giving a sinogram [Na, Nt], and then
+    filters each row with the optional response.
+    adjoint(g) is its transpose: filter with the conjugate response and delay-and-sum.
+    '''
+
+    def __init__(self, t, tita, rj, vs:float, Rs:float, response=None, chunkSize:int=1<<21, maxTableBytes:int=512*1024**2):
+        """
+        t: uniform time axis [Nt,]
+        tita: angles [Na,], rad
+        rj: pixel positions [2, N]
+        vs: speed of sound of the medium, m/s
+        Rs: distance between the transducer and the rotation axis of the sample
+        response: optional real-FFT transfer function [Nt//2+1,] applied to every row (e.g. the
+                  band-limited response left by the deconvolution, see usrtIterative)
+        chunkSize: max number of (angle, pixel) delays evaluated at once
+        maxTableBytes: the interpolation tables are kept in memory if they fit, and recomputed
+                       chunk by chunk on every application otherwise
+        """
+        self._t = np.asarray(t, dtype=np.float32)
+        self._tita = np.asarray(tita, dtype=np.float32)
+        self._rj = rj
+        self._vs = vs
+        self._Rs = Rs
+        self.Na = len(self._tita)
+        self.Nt = len(self._t)
+        self.N = rj.shape[1]
+        self._response = None if response is None else np.asarray(response, dtype=np.complex64)
+        self._nPix = max(1, chunkSize//self.Na)
+        self._rowOffset = (np.arange(self.Na, dtype=np.int64)*self.Nt)[:, None]
+        self._tables = None
+        if 8*self.Na*self.N <= maxTableBytes:
+            self._tables = list(self._computeTables())
+
+
+    def _computeTables(self):
+        indexType = np.int32 if self.Na*self.Nt < 2**31 else np.int64
+        for j0 in range(0, self.N, self._nPix):
+            i0, frac = interpTable(self._t, self._tita, self._rj[:, j0:j0+self._nPix], self._vs, self._Rs)
+            yield j0, (i0 + self._rowOffset).astype(indexType), frac
+
+
+    def _iterTables(self):
+        return self._tables if self._tables is not None else self._computeTables()
+
+
+    def forward(self, f):
+        '''Sinogram [Na, Nt] float32 of the image f [N,]'''
+        f = np.asarray(f, dtype=np.float32).ravel()
+        size = self.Na*self.Nt
+        g = np.zeros(size, dtype=np.float64)
+        for j0, idx, frac in self._iterTables():
+            w1 = frac*f[j0:j0+idx.shape[1]]
+            w0 = f[j0:j0+idx.shape[1]] - w1
+            g += np.bincount(idx.ravel(), w0.ravel(), size)
+            g += np.bincount(idx.ravel() + 1, w1.ravel(), size)
+        g = g.astype(np.float32).reshape(self.Na, self.Nt)
+        if self._response is not None:
+            g = np.fft.irfft(np.fft.rfft(g, axis=1)*self._response, self.Nt, axis=1)
+        return g
+
+
+    def adjoint(self, g):
+        '''Image [N,] float32 backprojected from the sinogram g [Na, Nt]'''
+        if self._response is not None:
+            g = np.fft.irfft(np.fft.rfft(np.asarray(g, dtype=np.float32), axis=1)*np.conjugate(self._response), self.Nt, axis=1)
+        g = np.ascontiguousarray(g, dtype=np.float32).ravel()
+        F = np.empty(self.N, dtype=np.float32)
+        for j0, idx, frac in self._iterTables():
+            v0 = g[idx]
+            F[j0:j0+idx.shape[1]] = (v0 + frac*(g[idx+1] - v0)).sum(axis=0)
+        return F
+
+
+    def normEstimate(self, nIter:int=20, seed:int=0):
+        '''Largest singular value squared of the operator, ||A^T A||, by power iteration'''
+        x = np.random.default_rng(seed).standard_normal(self.N).astype(np.float32)
+        L = 1.0
+        for _ in range(nIter):
+            x /= np.linalg.norm(x)
+            x = self.adjoint(self.forward(x))
+            L = float(np.linalg.norm(x))
+        return L
+
+
+###############################################################################
+def cgls(op, data, nIter:int=30, x0=None, callback=None):
+    """
+    Conjugate gradient least squares: min ||A x - data||^2
+    op: DelayOperator (or any object with forward/adjoint)
+    data: sinogram [Na, Nt]
+    x0: initial image [N,], zero by default
+    callback: called as callback(k, x, residualNorm) after each iteration
+    Returns the image [N,]
+    """
+    x = np.zeros(op.N, dtype=np.float32) if x0 is None else np.array(x0, dtype=np.float32).ravel()
+    r = np.asarray(data, dtype=np.float32) - (op.forward(x) if x0 is not None else 0)
+    s = op.adjoint(r)
+    p = s.copy()
+    gamma = float(np.dot(s, s))
+    for k in range(nIter):
+        if gamma == 0:
+            break
+        q = op.forward(p)
+        alpha = gamma/float(np.vdot(q, q))
+        x += alpha*p
+        r -= alpha*q
+        s = op.adjoint(r)
+        gammaNew = float(np.dot(s, s))
+        p = s + (gammaNew/gamma)*p
+        gamma = gammaNew
+        if callback is not None:
+            callback(k, x, float(np.linalg.norm(r)))
+    return x
+
+
+def _grad2D(u):
+    gx = np.zeros_like(u)
+    gy = np.zeros_like(u)
+    gx[:, :-1] = u[:, 1:] - u[:, :-1]
+    gy[:-1, :] = u[1:, :] - u[:-1, :]
+    return gx, gy
+
+
+def _div2D(px, py):
+    '''Divergence, minus the transpose of _grad2D'''
+    d = np.zeros_like(px)
+    d[:, :-1] += px[:, :-1]
+    d[:, 1:] -= px[:, :-1]
+    d[:-1, :] += py[:-1, :]
+    d[1:, :] -= py[:-1, :]
+    return d
+
+
+def denoiseTV(b, weight:float, nIter:int=10, p=None):
+    """
+    Isotropic TV denoising, min 1/2 ||u - b||^2 + weight*TV(u), with Chambolle's
+    projection algorithm.
+    b: image [ny, nx]
+    p: dual variable (px, py) of a previous call, to warm start
+    Returns (u, p)
+    """
+    if weight <= 0:
+        return b.copy(), p
+    px, py = (np.zeros_like(b), np.zeros_like(b)) if p is None else p
+    tau = 0.125
+    for _ in range(nIter):
+        gx, gy = _grad2D(_div2D(px, py) - b/weight)
+        norm = 1 + tau*np.sqrt(gx*gx + gy*gy)
+        px = (px + tau*gx)/norm
+        py = (py + tau*gy)/norm
+    return b - weight*_div2D(px, py), (px, py)
+
+
+def fistaTV(op, data, shape, nIter:int=50, tv:float=0.01, nonneg:bool=False, innerIter:int=10, L:float=None, x0=None, callback=None):
+    """
+    FISTA for min 1/2 ||A x - data||^2 + lam*TV(x)
+    op: DelayOperator (or any object with forward/adjoint)
+    data: sinogram [Na, Nt]
+    shape: image shape (ny, nx) used by the TV term
+    tv: TV weight relative to the scale of the image: lam = tv*max|A^T data|
+    nonneg: keeps the image >= 0
+    innerIter: iterations of the TV denoising of each step (warm started)
+    L: ||A^T A||, estimated by power iteration when None
+    x0: initial image [N,], zero by default
+    callback: called as callback(k, x, residualNorm) after each iteration
+    Returns the image [N,]
+    """
+    data = np.asarray(data, dtype=np.float32)
+    if L is None:
+        L = 1.05*op.normEstimate()
+    lam = tv*float(np.max(np.abs(op.adjoint(data))))
+    x = np.zeros(op.N, dtype=np.float32) if x0 is None else np.array(x0, dtype=np.float32).ravel()
+    y = x.copy()
+    tk = 1.0
+    dual = None
+    for k in range(nIter):
+        residual = op.forward(y) - data
+        z = (y - op.adjoint(residual)/L).reshape(shape)
+        xNew, dual = denoiseTV(z, lam/L, innerIter, dual)
+        if nonneg:
+            np.maximum(xNew, 0, out=xNew)
+        xNew = xNew.ravel()
+        tNew = (1 + np.sqrt(1 + 4*tk*tk))/2
+        y = xNew + ((tk - 1)/tNew)*(xNew - x)
+        x, tk = xNew, tNew
+        if callback is not None:
+            callback(k, x, float(np.linalg.norm(residual)))
+    return x
+
+
+###############################################################################
+def usrtIterative(sino,pt,t,Snoise,hfrec,vs,nx,dx,Rs,arc, method='fista', nIter=50, tv=0.01, nonneg=False, callback=None, rj=None, shape=None, scales=None):
+    """
+    Model-based reconstruction with the delay geometry of usrt: the sinogram is
+    deconvolved (without the ramp filter) and the image x solving
+    min ||A x - data||^2 (+ TV) is found with matrix-free iterations, where A
+    projects the image on the delays and applies the band-limited response of
+    the deconvolution. Sparse angular sampling gives fewer streaks than with the
+    filtered backprojection.
+    The image is in units of the absorber that produced pt, per pixel.
+    method: 'cgls' (least squares, stop early with nIter to regularize) or
+            'fista' (TV regularized, see fistaTV)
+    nIter: number of iterations
+    tv, nonneg: see fistaTV
+    callback: called as callback(k, x, residualNorm) after each iteration
+    The rest of the arguments are those of usrt.
+    """
+    t = np.asarray(t).astype(np.float32)
+    Na = sino.shape[0]
+    tita = (np.linspace(0,arc*np.pi/180,Na+1)[0:-1]).astype(np.float32)
+    if rj is None:
+        rj = createImagegrid2D(nx,dx)
+        shape = (nx,nx)
+    elif shape is None:
+        shape = (rj.shape[1],)
+
+    data = filterSinogram(sino, pt, t, Snoise, hfrec, vs, scales=scales, ramp=False)
+    response = wienerKernel(pt, t, Snoise, hfrec, vs, ramp=False)*np.fft.rfft(np.asarray(pt, dtype=np.float32))
+    op = DelayOperator(t, tita, rj, vs, Rs, response)
+    with tracing.span('usrtIterative', method=method, iterations=nIter, angles=Na, pixels=op.N):
+        if method == 'cgls':
+            x = cgls(op, data, nIter, callback=callback)
+        elif method == 'fista':
+            if len(shape) != 2:
+                raise ValueError("fista needs a 2D image shape")
+            x = fistaTV(op, data, shape, nIter, tv, nonneg, callback=callback)
+        else:
+            raise ValueError("method must be 'cgls' or 'fista'")
+    return np.reshape(x, shape)
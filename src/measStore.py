@@ -0,0 +1,143 @@
+import json
+import os
+import time
+import numpy as np
+
+
+class MeasStore(object):
+    '''Append-only binary store of a scan: raw scope codes per angle plus their scale factors and metadata
+
+    Layout of the store folder:
+        meta.json   channels, points per record, code type and scan metadata
+        codes.u8    one [nCh, Np] uint8 block per angle, memory-mappable as [Na, nCh, Np]
+                    (codes.u16 and uint16 blocks for 2 byte or decimated codes)
+        index.f8    one float64 row per angle: angle, xze, xin, numAcq, yze[nCh], ymu[nCh], yoff[nCh]
+    A row is appended to index.f8 only after its codes are written, so an interrupted
+    append leaves at most some unreferenced bytes at the end of codes.u8.
+    '''
+
+    def __init__(self, path:str, onAppend=None):
+        """
+        path: folder of the store
+        onAppend: optional callable run as onAppend(path) after each append (e.g. MeasCatalog.add)
+        """
+        self._path = path
+        self._onAppend = onAppend
+        self._meta = None
+        metaPath = os.path.join(path, 'meta.json')
+        if os.path.exists(metaPath):
+            with open(metaPath) as f:
+                self._meta = json.load(f)
+
+
+    def _create(self, channels, nPoints, codeType, metadata):
+        os.makedirs(self._path, exist_ok=True)
+        self._meta = {'channels': list(channels), 'nPoints': int(nPoints), 'codeType': np.dtype(codeType).str,
+                      'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'metadata': dict(metadata)}
+        self._saveMeta()
+
+
+    def _saveMeta(self):
+        metaPath = os.path.join(self._path, 'meta.json')
+        with open(metaPath + '.tmp', 'w') as f:
+            json.dump(self._meta, f, indent=1)
+        os.replace(metaPath + '.tmp', metaPath)
+
+
+    def _codeType(self):
+        return np.dtype(self._meta.get('codeType', '|u1'))
+
+
+    def _codesPath(self):
+        return os.path.join(self._path, 'codes.u8' if self._codeType().itemsize == 1 else 'codes.u16')
+
+
+    def _rowSize(self):
+        return 4 + 3*len(self._meta['channels'])
+
+
+    def append(self, angle:float, waveform, **metadata):
+        '''Appends the OscWaveform measured at angle [°]. Keyword arguments are stored as scan metadata on the first append.'''
+        if self._meta is None:
+            self._create(waveform.channels, waveform.codes.shape[1], waveform.codes.dtype, metadata)
+        if (list(waveform.channels) != self._meta['channels'] or waveform.codes.shape[1] != self._meta['nPoints']
+                or waveform.codes.dtype.itemsize != self._codeType().itemsize):
+            raise ValueError("The waveform does not match the channels/record length/code size of the store")
+        n = len(self)
+        codes = np.ascontiguousarray(waveform.codes, dtype=self._codeType())
+        with open(self._codesPath(), 'r+b' if n else 'wb') as f:
+            f.seek(n*codes.nbytes)
+            f.write(codes.tobytes())
+            f.truncate()
+        numAcq = np.nan if waveform.numAcq is None else waveform.numAcq
+        row = np.concatenate(([angle, waveform.xze, waveform.xin, numAcq], waveform.yze, waveform.ymu, waveform.yoff))
+        with open(os.path.join(self._path, 'index.f8'), 'ab') as f:
+            f.write(row.astype(np.float64).tobytes())
+        if self._onAppend is not None:
+            self._onAppend(self._path)
+
+
+    def __len__(self):
+        indexPath = os.path.join(self._path, 'index.f8')
+        if self._meta is None or not os.path.exists(indexPath):
+            return 0
+        return os.path.getsize(indexPath)//(8*self._rowSize())
+
+
+    def getIndex(self):
+        n = len(self)
+        return np.fromfile(os.path.join(self._path, 'index.f8'), dtype=np.float64, count=n*self._rowSize()).reshape(n, self._rowSize())
+
+
+    def getMetadata(self):
+        return dict(self._meta['metadata'])
+
+
+    def setMetadata(self, **metadata):
+        self._meta['metadata'].update(metadata)
+        self._saveMeta()
+
+
+    def getChannels(self):
+        return tuple(self._meta['channels'])
+
+
+    def getAngles(self):
+        return self.getIndex()[:, 0]
+
+
+    def getNumAcq(self):
+        return self.getIndex()[:, 3]
+
+
+    def getTime(self):
+        '''Time axis of the first record, s'''
+        xze, xin = self.getIndex()[0, 1:3]
+        return xze + np.arange(self._meta['nPoints']) * xin
+
+
+    def getCodes(self):
+        '''Read-only memory map of the raw codes [Na, nCh, Np]'''
+        shape = (len(self), len(self._meta['channels']), self._meta['nPoints'])
+        return np.memmap(self._codesPath(), dtype=self._codeType(), mode='r', shape=shape)
+
+
+    def getScales(self, channel:int):
+        '''(yze, ymu, yoff) of every angle for the channel, each [Na,]'''
+        i = self._meta['channels'].index(channel)
+        nCh = len(self._meta['channels'])
+        index = self.getIndex()
+        return index[:, 4+i], index[:, 4+nCh+i], index[:, 4+2*nCh+i]
+
+
+    def getSinogramView(self, channel:int):
+        '''Codes of the channel [Na, Np] as a view of the memory map (no copy) and their scales.
+        Both can go straight to usrt: usrt(codes, ..., scales=scales)'''
+        i = self._meta['channels'].index(channel)
+        return self.getCodes()[:, i, :], self.getScales(channel)
+
+
+    def getSinogram(self, channel:int):
+        '''Sinogram of the channel in volts [Na, Np] (a copy)'''
+        codes, (yze, ymu, yoff) = self.getSinogramView(channel)
+        return (codes - yoff[:, None]) * ymu[:, None] + yze[:, None]
@@ -0,0 +1,179 @@
+import asyncio
+import time
+import numpy as np
+from measStore import MeasStore
+
+
+class ScanOrchestrator(object):
+    '''Tomography scan run as concurrent stages (move+acquire, persist, reconstruct) linked by bounded queues'''
+
+    def __init__(self, osc, rot, angles, scanDir:str, reconstructor=None, queueSize:int=4, schedule=None):
+        """
+        osc: configured Osctck
+        rot: configured RotmcESP, moved with absolute positions
+        angles: measurement angles, °
+        scanDir: folder of the MeasStore where the angles are saved
+        reconstructor: optional object with push(angle, values) (e.g. usrt.UsrtStream)
+        queueSize: max number of angles waiting in each queue
+        schedule: optional averaging.AveragingSchedule; the averaging count of each angle
+                  is then chosen by SNR (Osctck.acquireAdaptive) and saved at the end of the scan
+        """
+        self._osc = osc
+        self._rot = rot
+        self._angles = [float(a) for a in angles]     #numpy scalars are not JSON serializable (MeasStore metadata)
+        self._scanDir = scanDir
+        self._reconstructor = reconstructor
+        self._queueSize = queueSize
+        self._schedule = schedule
+        self._cancelled = False
+        self._completed = set()
+        self._timings = {'move': [], 'acquire': [], 'persist': [], 'reconstruct': []}
+        self._store = MeasStore(scanDir)
+
+
+    def cancel(self):
+        '''Stops the scan after the angle being measured. Angles already acquired are still saved.'''
+        self._cancelled = True
+
+
+    def runSync(self):
+        return asyncio.run(self.run())
+
+
+    async def run(self):
+        """Runs (or resumes) the scan. Returns the indexes of the angles completed."""
+        self._cancelled = False
+        self._completed = self.loadProgress()
+        if self._reconstructor is not None and self._completed:
+            t, sino, angles = self.getSinogram()
+            for angle, trace in zip(angles, sino):
+                await asyncio.to_thread(self._reconstructor.push, angle, trace)
+
+        persistQ = asyncio.Queue(self._queueSize)
+        reconQ = asyncio.Queue(self._queueSize)
+        stages = {asyncio.create_task(self._persistStage(persistQ)): persistQ}
+        if self._reconstructor is not None:
+            stages[asyncio.create_task(self._reconstructStage(reconQ))] = reconQ
+        else:
+            reconQ = None
+
+        producer = asyncio.create_task(self._hardwareStage(persistQ, reconQ))
+        drains = {}       #failed stage -> task emptying its queue
+        try:
+            pending = set(stages)
+            pending.add(producer)
+            while not producer.done():
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task is not producer:
+                        # A stage only ends before the producer when it fails: the scan stops after the
+                        # angle being measured, and its queue is emptied so the producer never waits on it
+                        self._cancelled = True
+                        drains[task] = asyncio.create_task(self._drain(stages[task]))
+            # The stages finish what was already acquired before stopping
+            for task, queue in stages.items():
+                await self._putEnd(queue, drains.get(task, task))
+            await asyncio.wait(list(stages) + list(drains.values()))
+        finally:
+            for task in [producer] + list(stages) + list(drains.values()):
+                task.cancel()       #Only when run itself is cancelled, the rest are done
+        for task in [producer] + list(stages):
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+        return sorted(self._completed)
+
+
+    @staticmethod
+    async def _putEnd(queue, consumer):
+        '''Queues the end mark, unless the consumer ends first (it would never take it)'''
+        put = asyncio.ensure_future(queue.put(None))
+        await asyncio.wait([put, consumer], return_when=asyncio.FIRST_COMPLETED)
+        put.cancel()
+
+
+    @staticmethod
+    async def _drain(queue):
+        while await queue.get() is not None:
+            pass
+
+
+    async def _hardwareStage(self, persistQ, reconQ):
+        await asyncio.to_thread(self._osc.open)
+        await asyncio.to_thread(self._rot.open)
+        try:
+            for k, angle in enumerate(self._angles):
+                if k in self._completed:
+                    continue
+                if self._cancelled:
+                    break
+                t0 = time.perf_counter()
+                await asyncio.to_thread(self._rot, 'ABS', angle)
+                t1 = time.perf_counter()
+                if self._schedule is None:
+                    waveform = await asyncio.to_thread(self._osc.acquireRaw, angle)
+                else:
+                    waveform = await asyncio.to_thread(self._osc.acquireAdaptive, self._schedule, angle)
+                t2 = time.perf_counter()
+                self._timings['move'].append(t1 - t0)
+                self._timings['acquire'].append(t2 - t1)
+                await persistQ.put((k, angle, waveform))
+                if reconQ is not None:
+                    await reconQ.put((k, angle, waveform))
+        finally:
+            await asyncio.to_thread(self._osc.close)
+            await asyncio.to_thread(self._rot.close)
+            if self._schedule is not None and self._schedule.getPath() is not None:
+                self._schedule.save()
+
+
+    async def _persistStage(self, queue):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            t0 = time.perf_counter()
+            await asyncio.to_thread(self.saveAngle, *item)
+            self._timings['persist'].append(time.perf_counter() - t0)
+
+
+    async def _reconstructStage(self, queue):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            k, angle, waveform = item
+            t0 = time.perf_counter()
+            await asyncio.to_thread(self._reconstructor.push, angle, waveform.toArray())
+            self._timings['reconstruct'].append(time.perf_counter() - t0)
+
+
+    def saveAngle(self, k, angle, waveform):
+        self._store.append(angle, waveform, angles=self._angles)
+        self._completed.add(k)
+
+
+    def loadProgress(self):
+        if len(self._store) == 0:
+            return set()
+        if self._store.getMetadata().get('angles') != self._angles:
+            raise ValueError("The scan saved in {0} has other angles".format(self._scanDir))
+        stored = set(self._store.getAngles().tolist())
+        return set(k for k, angle in enumerate(self._angles) if angle in stored)
+
+
+    def getStore(self):
+        return self._store
+
+
+    def getSinogram(self):
+        '''(t, sinogram [Na, Nt] of the first channel, angles) of the completed angles, sorted by angle'''
+        angles = self._store.getAngles()
+        order = np.argsort(angles, kind='stable')
+        sino = self._store.getSinogram(self._store.getChannels()[0])
+        return self._store.getTime(), sino[order], angles[order]
+
+
+    def getTimings(self):
+        '''Total and mean time of each stage, s'''
+        return {stage: {'total': float(np.sum(ts)), 'mean': float(np.mean(ts)) if ts else 0.0, 'count': len(ts)}
+                for stage, ts in self._timings.items()}
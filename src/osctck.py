@@ -1,11 +1,65 @@
-import pyvisa
 import numpy as np
 import time
+from instruments import getManager
+import tracing
+
+
+class OscWaveform(object):
+    '''Raw waveforms of one acquisition: scope codes plus the preamble needed to convert them'''
+
+    def __init__(self, channels, codes, yze, ymu, yoff, xze, xin):
+        self.channels = tuple(channels)
+        self.codes = codes                      #[nCh, Np] uint8 (DAT:WID 1) or uint16 codes as sent by the scope
+        self.yze = np.asarray(yze, dtype=float)  #[nCh,] vertical zero, V
+        self.ymu = np.asarray(ymu, dtype=float)  #[nCh,] volts per code
+        self.yoff = np.asarray(yoff, dtype=float) #[nCh,] code offset
+        self.xze = xze                          #time of the first point, s
+        self.xin = xin                          #sampling interval, s
+        self.numAcq = None                      #acquisitions (averages) actually completed
+        self.tAcq = None                        #(start, end) of the acquisition, time.monotonic() s
+
+
+    def getTime(self):
+        return self.xze + np.arange(self.codes.shape[1]) * self.xin
+
+
+    def getVolts(self, channel):
+        i = self.channels.index(channel)
+        return (self.codes[i] - self.yoff[i]) * self.ymu[i] + self.yze[i]
+
+
+    def toArray(self):
+        '''Same layout as Osctck.__call__: time axis followed by one row per channel, in volts'''
+        return np.vstack([self.getTime()] + [self.getVolts(chNum) for chNum in self.channels])
+
+
+    def clipped(self):
+        '''Channels whose codes reach the ends of the digitizer range'''
+        top = 255 << 8*(self.codes.dtype.itemsize - 1)        #2 byte codes carry the 8 bits in the high byte
+        return [ch for ch, codes in zip(self.channels, self.codes) if codes.min() == 0 or codes.max() >= top]
+
+
+    def decimate(self, factor:int):
+        """
+        Block mean of factor samples per point, timed at the center of each block.
+        The codes become 16-bit (same format as DAT:WID 2) to keep the resolution gained.
+        """
+        nCh, Np = self.codes.shape
+        n = Np//factor
+        gain = 256 if self.codes.dtype == np.uint8 else 1
+        blocks = self.codes[:, :n*factor].reshape(nCh, n, factor).mean(axis=2)
+        waveform = OscWaveform(self.channels, np.round(blocks*gain).astype(np.uint16), self.yze, self.ymu/gain, self.yoff*gain,
+                               self.xze + (factor - 1)/2*self.xin, self.xin*factor)
+        waveform.numAcq = self.numAcq
+        waveform.tAcq = self.tAcq
+        return waveform
 
 
 class Osctck(object):
     '''Class for handling Tektronix oscilloscopes of the TDS series using PyVISA interface'''    
 
+    _recordLength = 2500
+
     def __init__(self, resource:str):
         self._resource = resource
         self._channels = (1,)
@@ -16,41 +70,160 @@ class Osctck(object):
         self._triggerCoup = 'AC'
         self._acquisition = 1
         self._vAutoScale = False
+        self._session = False
+        # Shadow copy of the settings written to the instrument, plus the WFMP preambles: YZE/YMU/YOFF
+        # of each channel under ('WFMP', channel), valid until its scale changes, and XZE/XIN under
+        # ('WFMP', 'X'). It is the state of the shared Device, so every Osctck of the scope keeps it up to date.
+        self._state = {}
+        self._acqTimeout = 30.0 #Max time waiting for an acquisition sequence, s
+        self._lastNumAcq = None
+        self._scaleCache = {}   #(channel, angle) -> vertical scale chosen by fastAutorange
+        self._window = None     #(tStart, tStop) transferred, s; None for the whole record
+        self._decimation = 1
+        self._width = 1
         
 
     def __call__(self):
-        self.initComm()
+        return self.acquireRaw().toArray()
+
+
+    def acquireRaw(self, angle:float=None):
+        '''Same acquisition as __call__, returned as an OscWaveform with the raw codes.
+        angle: position of the sample, used to reuse the autorange scales (see fastAutorange)'''
+        with tracing.span('Osctck.acquireRaw', 'scan'):
+            if not self._session:
+                self.initComm()
+            with self._osci.lock:       #The acquisition is not mixed with commands of other threads
+                return self._acquireRaw(angle)
+
+
+    def _acquireRaw(self, angle):
         self.setEdgeTrigger(self._triggerSource, self._triggerSlope, self._triggerMode, self._triggerCoup, self._triggerLevel)
         
+        cached = []
         if self._vAutoScale == True:
-            for chNum in self._channels:
-                self.useAlternativeAutorange(chNum)
-        
-        self.setAcquisition(acqMode = 1)
-        if self._acquisition !=1:
-            self.setAcquisition(self._acquisition)
+            cached = [chNum for chNum in self._channels if self.fastAutorange(chNum, angle)]
         
-        self.stop()
-        values = self.getHorValues(self._channels[0])
-        for chNum in self._channels:
-            values = np.vstack((values, self.getVertValues(chNum)))            
-        self.run()        
+        waveform = self._acquireWaveforms()
+        clipped = waveform.clipped() if self._vAutoScale == True else []
+        if clipped:
+            for chNum in clipped:
+                key = (chNum, None if angle is None else float(angle))
+                self._scaleCache.pop(key, None)
+                if chNum in cached:        #The signal grew since the scale was cached
+                    self.fastAutorange(chNum, angle)
+                else:                      #The measured peak missed the clipping (finite MAX/MIN of a clipped shot)
+                    self.useAlternativeAutorange(chNum)
+                    if angle is not None:
+                        self._scaleCache[key] = self.getVertScale(chNum)
+            waveform = self._acquireWaveforms()
         
-        self.closeComm()        
-        return values
+        if not self._session:
+            self.setFreeRun()
+            self.closeComm()        
+        return waveform
+
+
+    def _acquireWaveforms(self):
+        self.setAcquisition(self._acquisition)
+        tStart = time.monotonic()
+        numAcq = self.acquireSequence(self._acquisition, self._acqTimeout)
+        tEnd = time.monotonic()
+        waveform = self.getWaveforms(self._channels)
+        waveform.numAcq = self._lastNumAcq = numAcq
+        waveform.tAcq = (tStart, tEnd)
+        return waveform
+
+
+    def acquireAdaptive(self, schedule, angle:float):
+        """
+        Acquisition with the averaging count that schedule (averaging.AveragingSchedule)
+        gives for the angle. Unknown angles are first measured with a single shot, which
+        is returned as is when it already meets the target SNR. Returns an OscWaveform.
+        """
+        nAvg = schedule.get(angle)
+        waveform = None
+        if nAvg is None:
+            waveform = self._acquireWith(1, angle)
+            nAvg = schedule.choose(waveform)
+        if waveform is None or nAvg != 1:      #A learned count of 1 still needs its acquisition
+            waveform = self._acquireWith(nAvg, angle)
+        schedule.update(angle, waveform)
+        return waveform
+
+
+    def _acquireWith(self, nAvg, angle=None):
+        acquisition = self._acquisition
+        self._acquisition = nAvg
+        try:
+            return self.acquireRaw(angle)
+        finally:
+            self._acquisition = acquisition
+
+
+    def __enter__(self):
+        self.open()
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def open(self):
+        '''Opens a long-lived session: later calls reuse it and only send the settings that changed'''
+        self.initComm()
+        self._session = True
+
+
+    def close(self):
+        self._session = False
+        self.setFreeRun()
+        self.closeComm()
 
            
     def initComm(self):
-        self._osci = pyvisa.ResourceManager().open_resource(self._resource)
+        self._osci = getManager().open(self._resource, 'usb')
+        self._state = self._osci.state      #Empty for a new session, shared with the other users of the scope
         #Setting of the curves to acquire
-        self._osci.write('DAT:ENC RPB')   #Data Format: Positive Binary. 
-        self._osci.write('DAT:WID 1')     #Number of bytes per data point: 1 byte.
-        self._osci.write("DAT:STAR 1")    #The curve to be transferred starts at the first data on the screen.
-        self._osci.write("DAT:STOP 2500") #The curve to be transferred ends at the last data on the screen.
+        self._setParam('DAT:ENC', 'RPB')   #Data Format: Positive Binary. 
+        self._setParam('DAT:WID', 1)       #Number of bytes per data point: 1 byte.
+        self._setParam("DAT:STAR", 1)      #The curve to be transferred starts at the first data on the screen.
+        self._setParam("DAT:STOP", 2500)   #The curve to be transferred ends at the last data on the screen.
 
     
     def closeComm(self):
-        self._osci.close()       #Closing the communication session with the oscilloscope.
+        getManager().release(self._resource)       #Closing the communication session with the oscilloscope (once no one else uses it).
+
+
+    def _clearState(self):
+        self._state.clear()
+
+
+    def _dropPreambles(self, channels=None, horizontal:bool=False):
+        '''Forgets the vertical preambles of the channels (all by default) and the horizontal one if asked'''
+        for key in list(self._state):
+            if isinstance(key, tuple) and key[1] != 'X' and (channels is None or key[1] in channels):
+                del self._state[key]
+        if horizontal:
+            self._state.pop(('WFMP', 'X'), None)
+
+
+    def _setParam(self, header, value):
+        '''Writes "header value" only if it differs from the last value written. Returns True if it was written.'''
+        value = str(value)
+        with self._osci.lock:
+            if self._state.get(header) == value:
+                return False
+            self._osci.write("{0} {1}".format(header, value))
+            self._state[header] = value
+            if header.startswith("CH"):       #Scale, position, probe... change the vertical preamble
+                self._dropPreambles((int(header[2]),))
+            elif header.startswith("HOR"):       #XZE is the time of the first point of the record, whatever DAT:STAR is
+                self._dropPreambles((), horizontal=True)
+            elif header in ("DAT:WID", "DAT:ENC"):
+                self._dropPreambles()
+        return True
    
 
     def config(self, channels:tuple, triggerSource:str, triggerLevel:float, triggerSlope:str, triggerMode:str, triggerCoup:str, acquisition:int, vAutoScale:bool):
@@ -65,16 +238,18 @@ class Osctck(object):
 
 
     def setVertScale(self, channel, vScale):
-        self._osci.write("CH{0}:SCA {1}".format(channel,vScale))
+        self._setParam("CH{0}:SCA".format(channel), vScale)
         
         
     def getVertScale(self, channel):
-        return float(self._osci.query("CH{0}:SCALE?".format(channel))) #Returns the current vertical scale of the channel.
+        vScale = float(self._osci.query("CH{0}:SCALE?".format(channel))) #Returns the current vertical scale of the channel.
+        self._state["CH{0}:SCA".format(channel)] = str(vScale)
+        return vScale
 
 
     def setHScale(self, horizontalScale, zero=0):
-        self._osci.write("HOR:SCA {0}".format(horizontalScale))
-        self._osci.write("HOR:POS {0}".format(zero))	
+        self._setParam("HOR:SCA", horizontalScale)
+        self._setParam("HOR:POS", zero)
 
 
     def run(self):
@@ -85,6 +260,38 @@ class Osctck(object):
         self._osci.write("ACQ:STATE STOP")   
 
 
+    def acquireSequence(self, nAcq=1, timeout=30.0, firstPoll=0.005, maxPoll=0.5):
+        '''Starts a single-sequence acquisition and polls ACQ:STATE? (with exponential backoff) until the
+        scope stops by itself after nAcq waveforms, or until timeout. Returns the acquisitions completed.'''
+        self._setParam("ACQ:STOPA", "SEQ")
+        self.run()                         #A new sequence also restarts the average
+        start = time.monotonic()
+        poll = firstPoll
+        while int(self._osci.query("ACQ:STATE?")) != 0:
+            remaining = timeout - (time.monotonic() - start)
+            if remaining <= 0:
+                self.stop()                #Keeps what was averaged so far
+                break
+            tracing.sleep(min(poll, remaining), 'ACQ:STATE poll')
+            poll = min(2*poll, maxPoll)
+        return min(int(self._osci.query("ACQ:NUMACQ?")), nAcq)
+
+
+    def setFreeRun(self):
+        '''Leaves the scope acquiring continuously, as after a front panel RUN'''
+        self._setParam("ACQ:STOPA", "RUNST")
+        self.run()
+
+
+    def setAcqTimeout(self, timeout:float):
+        self._acqTimeout = timeout
+
+
+    def getLastNumAcq(self):
+        '''Acquisitions (averages) completed in the last call'''
+        return self._lastNumAcq
+
+
     def setAcquisition(self, acqMode):
         if acqMode == 1:
             self.setSampAcquisition()
@@ -103,54 +310,186 @@ class Osctck(object):
 
 
     def setAvgAcquisition(self, nAvg):
-        self._osci.write("ACQ:MOD AVE")
-        self._osci.write("ACQ:NUMAV {0}".format(nAvg))
-        time.sleep(float(nAvg)/self.getTriggerFreq()) 
+        self._setParam("ACQ:MOD", "AVE")
+        self._setParam("ACQ:NUMAV", nAvg)
        
 
     def setSampAcquisition(self):
-        self._osci.write("ACQ:MOD SAMP")  #acquisitionMode can be SAMple, PEAKdetect or AVErage
-        time.sleep(2)
+        self._setParam("ACQ:MOD", "SAMP")  #acquisitionMode can be SAMple, PEAKdetect or AVErage
 
 
     def setEdgeTrigger(self, source="CH1", slope="FALL", mode="NORM", coupling="AC", level=0):
-        self._osci.write("TRIG:MAI:TYP EDGE")
-        self._osci.write("TRIG:MAI:EDGE:SOU {0}".format(source))    #source can be CH1, CH2, EXT, EXT5, LINE
-        self._osci.write("TRIG:MAI:EDGE:SLO {0}".format(slope))     #slope can be FALL or RISe
-        self._osci.write("TRIG:MAI:MOD {0}".format(mode))           #mode can be AUTO or NORMal
-        self._osci.write("TRIG:MAI:EDGE:COUP {0}".format(coupling)) #coupling can be AC or DC
-        self._osci.write("TRIG:MAI:LEV {0}".format(level))          #level must be between -1.4 and 1.6 
+        self._setParam("TRIG:MAI:TYP", "EDGE")
+        self._setParam("TRIG:MAI:EDGE:SOU", source)    #source can be CH1, CH2, EXT, EXT5, LINE
+        self._setParam("TRIG:MAI:EDGE:SLO", slope)     #slope can be FALL or RISe
+        self._setParam("TRIG:MAI:MOD", mode)           #mode can be AUTO or NORMal
+        self._setParam("TRIG:MAI:EDGE:COUP", coupling) #coupling can be AC or DC
+        self._setParam("TRIG:MAI:LEV", level)          #level must be between -1.4 and 1.6 
      
 
     def useAlternativeAutorange(self, channel):        
-        self.run()
         self.setAcquisition(1)
 
         vScale = self.getVertScale(channel)
+        self.acquireSequence(1, self._acqTimeout)
         maxValue = np.max(np.absolute(self.getVertValues(channel)))
         
         while 4*vScale <= maxValue:
             vScale = 4*vScale
             self.setVertScale(channel,vScale)
+            self.acquireSequence(1, self._acqTimeout)
             maxValue = np.max(np.absolute(self.getVertValues(channel)))            
         
         vScale = maxValue/3.7
         self.setVertScale(channel,vScale)
             
 
+    def fastAutorange(self, channel, angle:float=None, method:str='measure', maxSteps:int=3):
+        """
+        Sets the vertical scale of the channel from one single-shot acquisition, so that
+        its peak spans 3.7 divisions (as useAlternativeAutorange). The peak comes from the
+        scope measurements (MEASU:IMM MAX and MIN, method='measure') or from one curve
+        transfer (method='curve'). A clipped shot falls back to useAlternativeAutorange.
+        The scale is cached for (channel, angle): later calls with the same angle, e.g. in
+        the next scan, set it without measuring. acquireRaw checks every acquisition of the
+        autoscaled channels for clipping and corrects the scale (and the cache) if needed.
+        Returns True if the cached scale was used.
+        """
+        key = (channel, None if angle is None else float(angle))
+        if angle is not None and key in self._scaleCache:
+            self.setVertScale(channel, self._scaleCache[key])
+            return True
+
+        self.setAcquisition(1)
+        vScale = self.getVertScale(channel)
+        for step in range(maxSteps):
+            self.acquireSequence(1, self._acqTimeout)
+            peak = self._measurePeak(channel, method)
+            if peak is None:
+                self.useAlternativeAutorange(channel)
+                vScale = self.getVertScale(channel)
+                break
+            newScale = peak/3.7
+            resolved = peak >= vScale    #At least one division: enough codes for the estimate
+            vScale = newScale
+            self.setVertScale(channel, vScale)
+            if resolved:
+                break
+        if angle is not None:
+            self._scaleCache[key] = vScale
+        return False
+
+
+    def _measurePeak(self, channel, method):
+        '''max |V| of the last acquisition of the channel, None if it was clipped'''
+        if method == 'curve':
+            self._setParam("DAT:SOU", "CH{0}".format(channel))
+            waveform = self.getWaveforms((channel,))
+            if waveform.clipped():
+                return None
+            return float(np.max(np.absolute(waveform.getVolts(channel))))
+        self._setParam("MEASU:IMM:SOU", "CH{0}".format(channel))
+        values = []
+        for measurement in ("MAX", "MIN"):
+            self._setParam("MEASU:IMM:TYP", measurement)
+            values.append(float(self._osci.query("MEASU:IMM:VAL?")))
+        if max(np.absolute(values)) >= 9.9e37:     #The scope answers 9.9E37 when the waveform is clipped
+            return None
+        return float(np.max(np.absolute(values)))
+
+
+    def getScaleCache(self):
+        '''{(channel, angle): vertical scale} chosen by fastAutorange, to reuse with setScaleCache in later scans'''
+        return dict(self._scaleCache)
+
+
+    def setScaleCache(self, scales:dict):
+        self._scaleCache = dict(((ch, None if angle is None else float(angle)), float(v)) for (ch, angle), v in scales.items())
+
+
+    def setTimeWindow(self, tStart:float=None, tStop:float=None, decimation:int=1, width=1):
+        """
+        Transfers only the part of the record between tStart and tStop, so the bytes per shot
+        fall in proportion to the window.
+        tStart, tStop: limits in the time of getHorValues, s (None: start/end of the record)
+        decimation: block mean of this many samples per point, on the host
+        width: bytes per point, 1, 2 (the extra byte keeps the resolution of the averages) or
+               'auto' (2 when averaging)
+        """
+        self._window = None if tStart is None and tStop is None else (tStart, tStop)
+        self._decimation = int(decimation)
+        self._width = width
+
+
+    def _applyWindow(self):
+        '''Sets DAT:WID and the DAT:STAR/STOP of the time window from the XZE/XIN preamble'''
+        width = self._width if self._width != 'auto' else (2 if self._acquisition > 1 else 1)
+        self._setParam('DAT:WID', width)
+        start, stop = 1, self._recordLength
+        if self._window is not None:
+            xze, xin = self.getHorPreamble()
+            tStart, tStop = self._window
+            if tStart is not None:
+                start = int(np.clip(np.floor((tStart - xze)/xin) + 1, 1, self._recordLength))
+            if tStop is not None:
+                stop = int(np.clip(np.ceil((tStop - xze)/xin) + 1, start, self._recordLength))
+        self._setParam("DAT:STAR", start)
+        self._setParam("DAT:STOP", stop)
+
+
+    def getWaveforms(self, channels):
+        '''One CURV? transfer per channel, of the time window. The preambles are only queried when they are not
+        cached, or on every read while the scope's auto-range may have changed the scales (see useAutorange).'''
+        if self._state.get('AUTOR:STATE') == 'ON':
+            self._dropPreambles(horizontal=True)
+        self._applyWindow()
+        codes = []
+        yPre = []
+        for chNum in channels:
+            self._setParam("SEL:CH{0}".format(chNum), "ON")
+            self._setParam("DAT:SOU", "CH{0}".format(chNum)) #The channel from which to read the data is selected.
+            yPre.append(self.getVertPreamble(chNum))
+            if self._state['DAT:WID'] == '2':
+                codes.append(self._osci.query_binary_values('CURV?', datatype='H', is_big_endian=True, container=np.array).astype(np.uint16))
+            else:
+                codes.append(self._osci.query_binary_values('CURV?', datatype='B', container=np.array).astype(np.uint8))
+        xze, xin = self.getHorPreamble()
+        yze, ymu, yoff = np.array(yPre).T
+        start = int(self._state["DAT:STAR"])
+        waveform = OscWaveform(channels, np.array(codes), yze, ymu, yoff, xze + (start - 1)*xin, xin)
+        if self._decimation > 1:
+            waveform = waveform.decimate(self._decimation)
+        return waveform
+
+
+    def getVertPreamble(self, channel):
+        key = ('WFMP', channel)
+        if key not in self._state:
+            with self._osci.lock:
+                self._setParam("DAT:SOU", "CH{0}".format(channel))
+                self._state[key] = tuple(self._osci.query_ascii_values('WFMP:YZE?;YMU?;YOFF?;', separator=';'))
+        return self._state[key]
+
+
+    def getHorPreamble(self):
+        key = ('WFMP', 'X')
+        if key not in self._state:
+            self._state[key] = tuple(self._osci.query_ascii_values('WFMP:XZE?;XIN?;', separator=';'))
+        return self._state[key]
+
+
     def getVertValues(self, channel):
-        self._osci.write("SEL:CH{0} ON".format(channel))
-        self._osci.write("DAT:SOU CH{0}".format(channel)) #The channel from which to read the data is selected.  
-        yze, ymu, yoff = self._osci.query_ascii_values('WFMP:YZE?;YMU?;YOFF?;', separator=';') 
-        dataY = (self._osci.query_binary_values('CURV?', datatype='B', container=np.array) - yoff) * ymu + yze
-        return np.array(dataY)
+        return self.getWaveforms((channel,)).getVolts(channel)
 
 
     def getHorValues(self, channel):
-        self._osci.write("SEL:CH{0} ON".format(channel))
-        self._osci.write("DAT:SOU CH{0}".format(channel)) #The channel from which to read the data is selected.
-        xze, xin = self._osci.query_ascii_values('WFMP:XZE?;XIN?;', separator=';')   
-        dataX = xze + np.arange(len(self.getVertValues(channel))) * xin
+        self._setParam("SEL:CH{0}".format(channel), "ON")
+        self._setParam("DAT:SOU", "CH{0}".format(channel)) #The channel from which to read the data is selected.
+        self._applyWindow()
+        xze, xin = self.getHorPreamble()
+        start = int(self._state["DAT:STAR"])
+        nPoints = (int(self._state["DAT:STOP"]) - start + 1)//self._decimation
+        dataX = xze + (start - 1 + (self._decimation - 1)/2 + np.arange(nPoints)*self._decimation) * xin
         return np.array(dataX)
     
 
@@ -164,15 +503,16 @@ class Osctck(object):
 
     def setupDefault(self):
         self._osci.write("RECALL:SETUP FACTORY")
+        self._clearState()
 
 
     def setChannel(self, channel, zero=0, coupling='AC', bwLimit='OFF', probeFactor=1, invert='OFF'):
         #self._osci.write("CH{0}:SCA {1}".format(channel, vScale))
-        self._osci.write("CH{0}:POS {1}".format(channel,zero))
-        self._osci.write("CH{0}:COUP {1}".format(channel,coupling)) #coupling can be AC, DC or GND
-        self._osci.write("CH{0}:BANDWIDTH {1}".format(channel,bwLimit)) #bwLimit can be ON or OFF
-        self._osci.write("CH{0}:PROBE {1}".format(channel,probeFactor)) #probeFactor can be 1, 10, 20, 50, 100, 500 or 1000
-        self._osci.write("CH{0}:INV {1}".format(channel,invert)) #invert can be ON or OFF
+        self._setParam("CH{0}:POS".format(channel), zero)
+        self._setParam("CH{0}:COUP".format(channel), coupling) #coupling can be AC, DC or GND
+        self._setParam("CH{0}:BANDWIDTH".format(channel), bwLimit) #bwLimit can be ON or OFF
+        self._setParam("CH{0}:PROBE".format(channel), probeFactor) #probeFactor can be 1, 10, 20, 50, 100, 500 or 1000
+        self._setParam("CH{0}:INV".format(channel), invert) #invert can be ON or OFF
 
 
     def getHScale(self):
@@ -180,24 +520,30 @@ class Osctck(object):
     
 
     def invertChannel(self, channel, state='OFF'):
-        self._osci.write("CH{0}:INV {1}".format(channel,state))
+        self._setParam("CH{0}:INV".format(channel), state)
         
 
     def useAutorange(self, setting):
         self._osci.write("AUTOR:SETT {0}".format(setting)) #setting can be HORizontal, VERTical or BOTH
         self._osci.write("AUTOR:STATE ON")
+        self._clearState()     #The instrument changes its own settings from now on
+        self._state['AUTOR:STATE'] = 'ON'      #Preambles are read again on every acquisition (see getWaveforms)
 
 
     def executeAutoSet(self):
         self._osci.write("AUTOS EXEC")
+        autorange = self._state.get('AUTOR:STATE')
+        self._clearState()
+        if autorange is not None:
+            self._state['AUTOR:STATE'] = autorange
 
 
     def showChannel(self, channel):
-        self._osci.write("SEL:CH{0} ON".format(channel))
+        self._setParam("SEL:CH{0}".format(channel), "ON")
 
 
     def hideChannel(self, channel):
-        self._osci.write("SEL:CH{0} OFF".format(channel))
+        self._setParam("SEL:CH{0}".format(channel), "OFF")
 
 
     def setFFTMode(self, channel, window = 'HANNING'):
@@ -0,0 +1,133 @@
+import os
+import time
+import threading
+import numpy as np
+
+
+class Preview(object):
+    '''Rate-limited, decimated live preview of a reconstruction
+
+    render previews are drawn on the thread calling update/close, as the pyplot GUI
+    backends need; headless previews (outDir) are written by a background thread.
+    '''
+
+    def __init__(self, nx:int, dx:float, everySeconds:float=2.0, everyAngles:int=None, maxPixels:int=128, render=None, outDir:str=None, fmt:str='png'):
+        """
+        nx = number of pixels per side of the image grid
+        dx = size of the pixel, m
+        everySeconds: minimum time between two previews
+        everyAngles: if given, a preview is also due every everyAngles angles
+        maxPixels: the preview is block-averaged down to at most maxPixels per side
+        render: function called as render(F, nx, dx) to draw a preview (e.g. usrt.plotResults),
+                from the thread calling update/close
+        outDir: headless mode, previews are written to this folder instead of drawn
+        fmt: 'png' or 'npy', format of the headless previews
+        """
+        if render is None and outDir is None:
+            raise ValueError("Either render or outDir must be given")
+        self._nx = nx
+        self._dx = dx
+        self._everySeconds = everySeconds
+        self._everyAngles = everyAngles
+        self._factor = max(1, -(-nx//maxPixels))
+        self._render = render
+        self._outDir = outDir
+        self._fmt = fmt
+        if outDir is not None:
+            os.makedirs(outDir, exist_ok=True)
+
+        self._lastTime = 0
+        self._pendingAngles = 0
+        self._count = 0
+        self._frame = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+        if outDir is not None:
+            self._thread = threading.Thread(target=self._worker, daemon=True)
+            self._thread.start()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def update(self, F, nAngles:int=1):
+        """Called by the compute loop after nAngles more angles were added to F. Cheap unless a preview is due."""
+        self._pendingAngles += nAngles
+        now = time.monotonic()
+        due = now - self._lastTime >= self._everySeconds
+        if self._everyAngles is not None and self._pendingAngles >= self._everyAngles:
+            due = True
+        if not due:
+            return
+        self._lastTime = now
+        self._pendingAngles = 0
+        self._post((self.decimate(F), self._nx//self._factor, self._dx*self._factor))
+
+
+    def close(self, F=None):
+        """Stops the preview thread. If F is given, it is shown at full resolution as the last frame."""
+        if F is not None:
+            self._post((np.array(F, dtype=np.float32).ravel(), self._nx, self._dx))
+        if self._thread is None:
+            return
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+
+    def decimate(self, F):
+        k = self._factor
+        n = self._nx//k
+        img = np.reshape(F, (self._nx, self._nx))[:n*k, :n*k]
+        return img.reshape(n, k, n, k).mean(axis=(1, 3), dtype=np.float32).ravel()
+
+
+    def _post(self, frame):
+        if self._thread is None:
+            self._show(*frame)
+            return
+        # Only the latest frame is kept, the thread skips those it could not write in time
+        with self._cond:
+            self._frame = frame
+            self._cond.notify()
+
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while self._frame is None and not self._closed:
+                    self._cond.wait()
+                frame, self._frame = self._frame, None
+                if frame is None:
+                    return
+            self._show(*frame)
+
+
+    def _show(self, F, nx, dx):
+        self._count += 1
+        if self._outDir is None:
+            self._render(F, nx, dx)
+        elif self._fmt == 'npy':
+            np.save(os.path.join(self._outDir, "preview_{0:04d}.npy".format(self._count)), np.reshape(F, (nx, nx)))
+        else:
+            self._savePng(F, nx, dx, os.path.join(self._outDir, "preview_{0:04d}.png".format(self._count)))
+
+
+    def _savePng(self, F, nx, dx, path):
+        # Figure is used without pyplot, so no display or GUI event loop is needed from this thread
+        from matplotlib.figure import Figure
+        fig = Figure(figsize=(6, 5))
+        ax = fig.add_subplot()
+        mm = nx//2*dx*1e3
+        im = ax.imshow(np.reshape(F, (nx, nx)), extent=(-mm, mm, -mm, mm))
+        fig.colorbar(im, ax=ax)
+        ax.set_xlabel('x [mm]')
+        ax.set_ylabel('y [mm]')
+        fig.savefig(path)
@@ -0,0 +1,242 @@
+"""
+Quick-look plots of many measurement traces. Each text file is parsed once
+into a TraceCache (with its spectrum, computed on first use), and only a
+min/max envelope with a couple of points per pixel column is drawn, recomputed
+from the cache when the view is zoomed.
+"""
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+import backends
+
+
+def loadTrace(path:str):
+    '''(t, V) of a measurement saved with np.savetxt (see utils.saveAngleMeas)'''
+    meas = np.loadtxt(path, dtype=float)
+    return meas[:,0], meas[:,1]
+
+
+def minMaxDecimate(x, y, nBins:int, log:bool=False):
+    """
+    Envelope of y(x) with the min and the max of each of nBins bins of x, in the
+    order they happen, so a line through them covers the same pixels as the full
+    trace. The first and last samples are kept. x must be increasing.
+    log: bins equally spaced in log(x) (for semilogx plots, x <= 0 is dropped)
+    Returns (xd, yd)
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if log:
+        keep = x > 0
+        x, y = x[keep], y[keep]
+    if len(x) <= 2*nBins:
+        return x, y
+    if log:
+        edges = np.geomspace(x[0], x[-1], nBins + 1)
+    else:
+        edges = np.linspace(x[0], x[-1], nBins + 1)
+    starts = np.unique(np.searchsorted(x, edges[:-1]))
+    starts = starts[starts < len(x)]
+    binOf = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(x))))
+    imin = _firstPerBin(y == np.minimum.reduceat(y, starts)[binOf], binOf)
+    imax = _firstPerBin(y == np.maximum.reduceat(y, starts)[binOf], binOf)
+    idx = np.column_stack((np.minimum(imin, imax), np.maximum(imin, imax))).ravel()
+    idx = np.unique(np.concatenate(([0], idx, [len(x) - 1])))
+    return x[idx], y[idx]
+
+
+def _firstPerBin(mask, binOf):
+    '''Index of the first True of mask in each bin (every bin has one)'''
+    hits = np.flatnonzero(mask)
+    bins = binOf[hits]
+    return hits[np.concatenate(([True], bins[1:] != bins[:-1]))]
+
+
+class TraceCache(object):
+    '''Traces and spectra of measurement files, parsed once and reloaded only when the file changes'''
+
+    def __init__(self, maxTraces:int=256):
+        """
+        maxTraces: traces kept in memory, the least recently used ones are dropped
+        """
+        self._maxTraces = maxTraces
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+
+    def _entry(self, path):
+        st = os.stat(path)
+        stamp = (st.st_mtime, st.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry['stamp'] == stamp:
+                self._entries.move_to_end(path)
+                return entry
+        t, y = loadTrace(path)
+        entry = {'stamp': stamp, 't': t, 'y': y, 'spectrum': None}
+        with self._lock:
+            self._entries[path] = entry
+            self._entries.move_to_end(path)
+            while len(self._entries) > self._maxTraces:
+                self._entries.popitem(last=False)
+        return entry
+
+
+    def get(self, path:str):
+        '''(t, V) of the file'''
+        entry = self._entry(path)
+        return entry['t'], entry['y']
+
+
+    def spectrum(self, path:str):
+        '''(f [Hz], |FFT|) of the file, from 0 to the Nyquist frequency (unnormalized)'''
+        entry = self._entry(path)
+        if entry['spectrum'] is None:
+            t, y = entry['t'], entry['y']
+            N = len(y)
+            entry['spectrum'] = (np.fft.rfftfreq(N, t[1] - t[0])[:N//2], np.abs(np.fft.rfft(y))[:N//2])
+        return entry['spectrum']
+
+
+    def preload(self, paths, workers:int=4):
+        '''Parses the files in a pool of threads'''
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(self._entry, paths))
+
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = TraceCache()
+
+
+def getCache():
+    return _cache
+
+
+def traceLabel(path:str):
+    return path.split("/")[-1].replace(".txt", "")
+
+
+class QuickLook(object):
+    '''Overlay of decimated traces (or spectra) on a matplotlib axes, re-decimated from the cache on zoom
+
+    Usage:
+        view = QuickLook()
+        for path in utils.getFilesList():
+            view.addTrace(path)
+        view.show()
+    '''
+
+    def __init__(self, ax=None, cache:TraceCache=None, pointsPerPixel:float=1):
+        """
+        ax: axes where the traces are drawn (a new figure by default)
+        cache: TraceCache of the files (the module one by default)
+        pointsPerPixel: min/max pairs per pixel column of the axes
+        """
+        if ax is None:
+            ax = backends.pyplot().figure().add_subplot()
+        self.ax = ax
+        self._cache = _cache if cache is None else cache
+        self._pointsPerPixel = pointsPerPixel
+        self._lines = []        #[line, x, y, log, (i0, i1, nBins) decimated]
+        ax.callbacks.connect('xlim_changed', self._onXlim)
+
+
+    def _nBins(self):
+        return max(16, int(self.ax.bbox.width*self._pointsPerPixel))
+
+
+    def _add(self, x, y, log, **kwargs):
+        nBins = self._nBins()
+        xd, yd = minMaxDecimate(x, y, nBins, log)
+        if log:
+            line, = self.ax.semilogx(xd, yd, **kwargs)
+        else:
+            line, = self.ax.plot(xd, yd, **kwargs)
+        self._lines.append([line, x, y, log, (0, len(x), nBins)])
+        return line
+
+
+    def addTrace(self, path:str, normalize:bool=False, relative:bool=True, **kwargs):
+        """
+        Adds the trace of a file.
+        normalize: divides it by its max
+        relative: time axis starting at 0
+        kwargs: passed to ax.plot (color, linewidth, ...); the label is the file name by default
+        """
+        t, y = self._cache.get(path)
+        if relative:
+            t = t - t[0]
+        if normalize:
+            y = y/np.max(y)
+        kwargs.setdefault('label', traceLabel(path))
+        return self._add(t, y, False, **kwargs)
+
+
+    def addSpectrum(self, path:str, normalize:bool=True, **kwargs):
+        """
+        Adds the magnitude of the FFT of a file, on a log frequency axis.
+        normalize: divides it by its max without the DC term, otherwise scales it as 2/N*|FFT|
+        """
+        f, Y = self._cache.spectrum(path)
+        Y = Y/np.max(Y[1:]) if normalize else Y*(2/len(self._cache.get(path)[1]))
+        kwargs.setdefault('label', traceLabel(path))
+        return self._add(f, Y, True, **kwargs)
+
+
+    def _onXlim(self, ax):
+        x0, x1 = sorted(ax.get_xlim())
+        nBins = self._nBins()
+        for entry in self._lines:
+            line, x, y, log, span = entry
+            i0 = max(int(np.searchsorted(x, x0)) - 1, 0)
+            i1 = min(int(np.searchsorted(x, x1)) + 1, len(x))
+            if (i0, i1, nBins) != span:       #Unchanged when the new limits show the same samples
+                line.set_data(*minMaxDecimate(x[i0:i1], y[i0:i1], nBins, log))
+                entry[4] = (i0, i1, nBins)
+
+
+    def show(self, legend:bool=True):
+        plt = backends.pyplot()
+        if legend and self._lines:
+            self.ax.legend(fontsize=12)
+        plt.ion()
+        plt.show()
+
+
+def getView(ax=None):
+    '''QuickLook of the axes (the current pyplot axes by default), so successive calls overlay their traces'''
+    if ax is None:
+        ax = backends.pyplot().gca()
+    view = getattr(ax, '_quicklook', None)
+    if view is None:
+        view = ax._quicklook = QuickLook(ax)     #Lives and dies with the axes
+    return view
+
+
+def plotTraces(paths, normalize:bool=False, ax=None):
+    '''Overlay of the traces of the files (e.g. utils.getFilesList()). Returns the QuickLook.'''
+    view = getView(ax)
+    for path in paths:
+        view.addTrace(path, normalize)
+    view.ax.set_xlabel("Tiempo [s]", fontsize=14)
+    view.ax.set_ylabel("Amplitud [V]", fontsize=14)
+    view.show()
+    return view
+
+
+def plotSpectra(paths, normalize:bool=True, ax=None):
+    '''Overlay of the normalized spectra of the files. Returns the QuickLook.'''
+    view = getView(ax)
+    for path in paths:
+        view.addSpectrum(path, normalize)
+    view.ax.set_xlabel("Frecuencia [Hz]")
+    view.ax.grid(True, which="both", ls="-")
+    view.show()
+    return view
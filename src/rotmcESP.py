@@ -1,6 +1,12 @@
-import pyvisa
 import numpy as np
-import time
+from instruments import getManager
+import tracing
+
+
+def _configureSerial(device):
+    device.baud_rate = 19200
+    device.read_termination = '\r'
+    device.write_termination = '\r'
 
 
 class RotmcESP(object):
@@ -12,30 +18,59 @@ class RotmcESP(object):
         self._vel = 5
         self._direction = '+'
         self._setOrigin = False
+        self._session = False
+        self._pending = []     #Setting commands sent in the same line as the next command
 
 
     def __call__(self, reference='ABS', rotAngle:float=0):
+        with tracing.span('RotmcESP.move', 'scan', reference=reference, angle=rotAngle):
+            return self._move(reference, rotAngle)
 
-        self.initComm()
+
+    def _move(self, reference, rotAngle):
+        if not self._session:
+            self.initComm()
         self.setVelocity(self._axis, self._vel)
 
         if self._setOrigin == True:
-            self._motorCont.write("{0}DH".format(self._axis))
+            self.setOrigin(self._axis)
             self._setOrigin = False
                     
         if reference == 'ABS':
-            self.moveToAbsPosition(self._axis, rotAngle)
+            self._moveAndWait(self._axis, "{0}PA{1}".format(self._axis, rotAngle), self._absDistance(self._axis, rotAngle))
 
         elif reference == 'REL':
-            self.moveToRelPosition(self._axis, rotAngle)
+            self._moveAndWait(self._axis, "{0}PR{1}".format(self._axis, rotAngle), rotAngle)
 
-        currPos = self.getPosition(self._axis)    
+        currPos = self._query("{0}MF".format(self._axis), "{0}TP".format(self._axis)).replace("\n", "")
+        self._state["{0}TP".format(self._axis)] = currPos
             
-        self.closeComm()
+        if not self._session:
+            self.closeComm()
 
         return currPos
 
 
+    def __enter__(self):
+        self.open()
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def open(self):
+        '''Opens a long-lived session: later calls reuse the serial connection and cached settings'''
+        self.initComm()
+        self._session = True
+
+
+    def close(self):
+        self._session = False
+        self.closeComm()
+
+
     def config(self, axis:int, vel:float, direction:str, setOrigin:bool):
         self._axis = axis
         self._vel = vel
@@ -44,79 +79,111 @@ class RotmcESP(object):
 
 
     def initComm(self):
-        self._motorCont = pyvisa.ResourceManager().open_resource(self._resource)
-        self._motorCont.baud_rate = 19200
-        self._motorCont.read_termination = '\r'
-        self._motorCont.write_termination = '\r'
+        # Every RotmcESP of the same controller (e.g. one per axis) shares its session and cached settings
+        self._motorCont = getManager().open(self._resource, 'serial', _configureSerial)
+        self._state = self._motorCont.state
 
 
     def closeComm(self):
-        self._motorCont.close()      
+        if self._pending:
+            self._send()
+        getManager().release(self._resource)
+
+
+    def _send(self, *cmds):
+        '''Writes the pending settings and cmds as a single ';' separated line'''
+        line = ";".join(self._pending + list(cmds))
+        self._pending = []
+        self._motorCont.write(line)
+
+
+    def _query(self, *cmds):
+        line = ";".join(self._pending + list(cmds))
+        self._pending = []
+        return self._motorCont.query(line)
+
+
+    def _setParam(self, axis, cmd, value):
+        '''Queues "{axis}{cmd}{value}" unless it is the value the controller already has'''
+        key = "{0}{1}".format(axis, cmd)
+        if self._state.get(key) == str(value):
+            return
+        self._pending.append("{0}{1}".format(key, value))
+        self._state[key] = str(value)
 
     
     def getID(self):
-        return self._motorCont.query("*IDN?").replace("\n", "")
+        return self._query("*IDN?").replace("\n", "")
     
 
     def setOrigin(self, axis):
-        self._motorCont.write("{0}DH".format(axis))
+        self._pending.append("{0}DH".format(axis))
+        self._state["{0}TP".format(axis)] = '0'
 
 
     def getPosition(self, axis):
-        return self._motorCont.query("{0}TP".format(axis)).replace("\n", "")
+        currPos = self._query("{0}TP".format(axis)).replace("\n", "")
+        self._state["{0}TP".format(axis)] = currPos
+        return currPos
 
 
     def setVelocity(self, axis, vel):
-        self._motorCont.write("{0}VA{1}".format(axis,vel))
+        self._setParam(axis, "VA", vel)
 
 
     def getVelocity(self, axis):
-        return self._motorCont.query("{0}VA?".format(axis)).replace("\n", "")
+        return self._query("{0}VA?".format(axis)).replace("\n", "")
 
 
     def setAcceleration(self, axis, acc):
-        self._motorCont.write("{0}AC{1}".format(axis,acc))
+        self._setParam(axis, "AC", acc)
 
 
     def getAcceleration(self, axis):
-        return self._motorCont.query("{0}AC?".format(axis)).replace("\n", "")
+        return self._query("{0}AC?".format(axis)).replace("\n", "")
     
 
     def enableAxis(self, axis):
-        self._motorCont.write("{0}MO".format(axis))
+        self._send("{0}MO".format(axis))
 
 
     def disableAxis(self, axis):
-        self._motorCont.write("{0}MF".format(axis))
+        self._send("{0}MF".format(axis))
 
-    
-    def moveToAbsPosition(self, axis, aPos):
-        self.enableAxis(axis)
-        self._motorCont.write("{0}PA{1}".format(axis,aPos))
 
-        while(not bool(int(self._motorCont.query("{0}MD?".format(axis))))):
-          time.sleep(0.01)
+    def _absDistance(self, axis, aPos):
+        '''Distance to aPos from the last position read, 0 if unknown'''
+        lastPos = self._state.get("{0}TP".format(axis))
+        return 0 if lastPos is None else float(aPos) - float(lastPos)
+
+
+    def _moveAndWait(self, axis, moveCmd, distance=0):
+        '''Enables the axis and sends the move in one line, then waits for the motion to be done'''
+        vel = self._state.get("{0}VA".format(axis))
+        self._state.pop("{0}TP".format(axis), None)
+        self._send("{0}MO".format(axis), moveCmd)
+        if vel is not None:
+            tracing.sleep(0.9*abs(distance)/float(vel), 'move wait')    #No need to poll while the move surely is in progress
+
+        while(not bool(int(self._query("{0}MD?".format(axis))))):
+          tracing.sleep(0.01, 'MD poll')
           #print("Axis {0} still moving".format(axis))
 
+    
+    def moveToAbsPosition(self, axis, aPos):
+        self._moveAndWait(axis, "{0}PA{1}".format(axis,aPos), self._absDistance(axis, aPos))
         self.disableAxis(axis)
 
 
     def moveToRelPosition(self, axis, rPos):
-        self.enableAxis(axis)
-        self._motorCont.write("{0}PR{1}".format(axis,rPos))
-
-        while(not bool(int(self._motorCont.query("{0}MD?".format(axis))))):
-          time.sleep(0.01)
-          #print("Axis {0} still moving".format(axis))
-
+        self._moveAndWait(axis, "{0}PR{1}".format(axis,rPos), rPos)
         self.disableAxis(axis)
 
 
     def moveIndefinitely(self, axis, direction):
-        self.enableAxis(axis)
-        self._motorCont.write("{0}MV{1}".format(axis,direction))  #direction could be "+" or "-" 
+        self._state.pop("{0}TP".format(axis), None)
+        self._send("{0}MO".format(axis), "{0}MV{1}".format(axis,direction))  #direction could be "+" or "-" 
 
 
     def stopMotion(self, axis):
-        self._motorCont.write("{0}ST".format(axis))
-        self.disableAxis(axis)
\ No newline at end of file
+        self._send("{0}ST".format(axis), "{0}MF".format(axis))
@@ -0,0 +1,362 @@
+import re
+import threading
+import time
+import numpy as np
+
+
+class SimRig(object):
+    '''Simulated photoacoustic rig: a TDS2024 and an ESP300 rotating a phantom of point absorbers'''
+
+    def __init__(self, absorbers=((1e-3, 2e-3, 1.0), (-2e-3, 0, 0.5)), Rs:float=42.625e-3, vs:float=1480,
+                 trigFreq:float=1000, noise:float=0.02, usbLatency:float=1e-3, usbBytesPerSecond:float=1e6,
+                 serialLatency:float=5e-3, serialBaud:int=19200, rotAxis:int=2):
+        """
+        absorbers: (x [m], y [m], amplitude [V]) of each point absorber
+        Rs: distance between the transducer and the rotation axis
+        vs: speed of sound of the medium, m/s
+        trigFreq: laser (trigger) repetition rate, Hz
+        noise: std of the noise of a single shot, V
+        usbLatency, usbBytesPerSecond: round trip time and transfer rate of the scope
+        serialLatency, serialBaud: round trip time and baud rate of the motion controller
+        rotAxis: axis of the controller that turns the sample
+        """
+        self.absorbers = np.array(absorbers, dtype=float)
+        self.Rs = Rs
+        self.vs = vs
+        self.trigFreq = trigFreq
+        self.noise = noise
+        self.usbLatency = usbLatency
+        self.usbBytesPerSecond = usbBytesPerSecond
+        self.serialLatency = serialLatency
+        self.serialBaud = serialBaud
+        self.rotAxis = rotAxis
+        self.rng = np.random.default_rng(0)
+        self.stage = SimESP300(self)
+        self.scope = SimTDS2024(self)
+
+
+    def getAngle(self):
+        return self.stage.position(self.rotAxis)
+
+
+    def signal(self, t, angle):
+        '''Noiseless photoacoustic signal [V] at the transducer for the given angle [°]'''
+        tita = angle*np.pi/180
+        y = np.zeros(len(t))
+        sigma = 50e-9
+        for x0, y0, amp in self.absorbers:
+            ta = 2/self.vs*(self.Rs - x0*np.cos(tita) - y0*np.sin(tita))
+            u = (t - ta)/sigma
+            y += -amp*u*np.exp(-u**2/2)       #N-shaped pulse of a small absorber
+        return y
+
+
+class SimTDS2024(object):
+    '''Simulated Tektronix TDS2024 answering the SCPI subset used by Osctck'''
+
+    def __init__(self, rig):
+        self._rig = rig
+        self._lock = threading.Lock()
+        self.bytesRead = 0
+        self.bytesWritten = 0
+        self.nCommands = 0
+        self._settings = {'DAT:ENC': 'RPB', 'DAT:WID': '1', 'DAT:STAR': '1', 'DAT:STOP': '2500', 'DAT:SOU': 'CH1',
+                          'ACQ:MOD': 'SAMP', 'ACQ:NUMAV': '16', 'ACQ:STOPA': 'RUNST', 'HOR:SCA': '2.5e-6', 'HOR:POS': '0'}
+        for ch in range(1, 5):
+            self._settings['CH{0}:SCA'.format(ch)] = '0.1'
+            self._settings['CH{0}:POS'.format(ch)] = '0'
+        self._running = True
+        self._acqStart = time.monotonic()
+        self._acqStop = None
+        self._waveform = None
+
+
+    def _io(self, nBytes):
+        self.nCommands += 1
+        time.sleep(self._rig.usbLatency + nBytes/self._rig.usbBytesPerSecond)
+
+
+    def write(self, cmd):
+        with self._lock:
+            self.bytesWritten += len(cmd) + 1
+            self._io(len(cmd) + 1)
+            for part in cmd.split(';'):
+                header, _, value = part.strip().partition(' ')
+                header = header.upper()
+                if header == 'ACQ:STATE':
+                    self._setRunning(value.upper() in ('RUN', '1', 'ON'))
+                elif header in ('RECALL:SETUP', 'AUTOS', 'AUTOR:STATE'):
+                    pass
+                else:
+                    self._settings[header] = value
+
+
+    def query(self, cmd):
+        with self._lock:
+            answer = ';'.join(self._answer(q.strip().upper()) for q in cmd.strip().rstrip(';').split(';'))
+            self.bytesWritten += len(cmd) + 1
+            self.bytesRead += len(answer) + 1
+            self._io(len(cmd) + len(answer) + 2)
+            return answer
+
+
+    def query_ascii_values(self, cmd, separator=','):
+        return [float(v) for v in self.query(cmd).split(separator)]
+
+
+    def query_binary_values(self, cmd, datatype='B', is_big_endian=False, container=list):
+        with self._lock:
+            codes = self._curve()
+            nBytes = codes.nbytes + 8          #definite length block header
+            self.bytesWritten += len(cmd) + 1
+            self.bytesRead += nBytes
+            self._io(nBytes)
+            return container(codes)
+
+
+    def close(self):
+        pass
+
+
+    def _setRunning(self, run):
+        now = time.monotonic()
+        if run:
+            self._running = True
+            self._acqStart = now
+            self._acqStop = None
+            self._waveform = None
+        elif self._running:
+            self._running = False
+            self._acqStop = now
+
+
+    def _targetAcq(self):
+        return int(self._settings['ACQ:NUMAV']) if self._settings['ACQ:MOD'].startswith('AVE') else 1
+
+
+    def _numAcq(self):
+        end = time.monotonic() if self._running else self._acqStop
+        n = int((end - self._acqStart)*self._rig.trigFreq + 1e-6)
+        if self._settings['ACQ:STOPA'].startswith('SEQ'):
+            n = min(n, self._targetAcq())
+            if self._running and n >= self._targetAcq():
+                self._running = False
+                self._acqStop = self._acqStart + n/self._rig.trigFreq
+        return n
+
+
+    def _codeGain(self):
+        '''2 byte codes carry the 8 bit code in the high byte and the extra resolution of averages in the low one'''
+        return 256 if self._settings['DAT:WID'] == '2' else 1
+
+
+    def _yPreamble(self, ch):
+        scale = float(self._settings['CH{0}:SCA'.format(ch)])
+        pos = float(self._settings['CH{0}:POS'.format(ch)])
+        return 0.0, scale/25, 128 + pos*25   #YZE, YMU, YOFF: 25 codes per division
+
+
+    def _xPreamble(self):
+        xin = float(self._settings['HOR:SCA'])*10/2500
+        xze = 40e-6 + float(self._settings['HOR:POS'])
+        return xze, xin
+
+
+    def _answer(self, q):
+        ch = int(self._settings['DAT:SOU'][-1])
+        if q.startswith('ACQ:STATE?'):
+            self._numAcq()
+            return '1' if self._running else '0'
+        if q.startswith('ACQ:NUMACQ?'):
+            return str(self._numAcq())
+        if q.startswith('TRIG') and 'FREQ' in q:
+            return str(self._rig.trigFreq)
+        if q.startswith('*IDN?'):
+            return 'TEKTRONIX,TDS 2024,SIMULATED,CF:91.1CT FV:v4.12'
+        if q.startswith('*OPC?'):
+            return '1'
+        m = re.match(r'CH(\d):SCA\w*\?', q)
+        if m:
+            return self._settings['CH{0}:SCA'.format(m.group(1))]
+        if q.startswith('WFMP:YZE'):
+            return str(self._yPreamble(ch)[0])
+        if q.startswith('YMU') or q.startswith('WFMP:YMU'):
+            return str(self._yPreamble(ch)[1]/self._codeGain())
+        if q.startswith('YOFF') or q.startswith('WFMP:YOFF'):
+            return str(self._yPreamble(ch)[2]*self._codeGain())
+        if q.startswith('WFMP:XZE'):
+            return str(self._xPreamble()[0])
+        if q.startswith('XIN') or q.startswith('WFMP:XIN'):
+            return str(self._xPreamble()[1])
+        if q.startswith('WFMP:NR_P'):
+            return '2500'
+        if q.startswith('MEASU:IMM:VAL'):
+            return self._measurement()
+        if q.startswith('HOR?'):
+            return 'HOR:SCA {0};POS {1}'.format(self._settings['HOR:SCA'], self._settings['HOR:POS'])
+        header = q.rstrip('?')
+        return self._settings.get(header, '0')
+
+
+    def _record(self):
+        '''Full 2500 point record of the current acquisition, in volts'''
+        if self._waveform is None or self._running:
+            nAcq = max(1, self._numAcq())
+            xze, xin = self._xPreamble()
+            t = xze + np.arange(2500)*xin
+            clean = self._rig.signal(t, self._rig.getAngle())
+            self._waveform = clean + self._rig.rng.normal(0, self._rig.noise/np.sqrt(nAcq), 2500)
+        return self._waveform
+
+
+    def _measurement(self):
+        '''MEASU:IMM:VAL? of the MAX, MIN or PK2PK of the record, 9.9E37 if it is clipped'''
+        ch = int(self._settings.get('MEASU:IMM:SOU', 'CH1')[-1])
+        yze, ymu, yoff = self._yPreamble(ch)
+        codes = np.round((self._record() - yze)/ymu + yoff)
+        if codes.min() <= 0 or codes.max() >= 255:
+            return '9.9E37'
+        volts = (codes - yoff)*ymu + yze
+        kind = self._settings.get('MEASU:IMM:TYP', 'PK2PK')
+        if kind.startswith('MAX'):
+            value = volts.max()
+        elif kind.startswith('MIN'):
+            value = volts.min()
+        elif kind.startswith('PK2'):
+            value = volts.max() - volts.min()
+        else:
+            value = 0.0
+        return '{0:.4E}'.format(value)
+
+
+    def _curve(self):
+        ch = int(self._settings['DAT:SOU'][-1])
+        yze, ymu, yoff = self._yPreamble(ch)
+        start = int(self._settings['DAT:STAR']) - 1
+        stop = int(self._settings['DAT:STOP'])
+        gain = self._codeGain()
+        codes = np.round(((self._record()[start:stop] - yze)/ymu + yoff)*gain)
+        if gain == 1:
+            return np.clip(codes, 0, 255).astype(np.uint8)
+        return np.clip(codes, 0, 255*gain).astype(np.uint16)
+
+
+class SimESP300(object):
+    '''Simulated Newport ESP300 answering the commands used by RotmcESP'''
+
+    def __init__(self, rig):
+        self._rig = rig
+        self._lock = threading.Lock()
+        self.baud_rate = 19200
+        self.read_termination = '\r'
+        self.write_termination = '\r'
+        self.bytesRead = 0
+        self.bytesWritten = 0
+        self.nCommands = 0
+        self._axes = {}
+
+
+    def _axis(self, n):
+        if n not in self._axes:
+            self._axes[n] = {'pos': 0.0, 'vel': 5.0, 'acc': 20.0, 'on': False, 't0': 0.0, 'target': None, 'dir': 0}
+        return self._axes[n]
+
+
+    def position(self, n):
+        ax = self._axis(n)
+        if ax['dir'] == 0:
+            return ax['pos']
+        p = ax['pos'] + ax['dir']*ax['vel']*(time.monotonic() - ax['t0'])
+        if ax['target'] is not None and (p - ax['target'])*ax['dir'] >= 0:
+            ax['pos'], ax['dir'] = ax['target'], 0
+            return ax['pos']
+        return p
+
+
+    def _startMove(self, ax, n, target=None, direction=0):
+        ax['pos'] = self.position(n)
+        ax['t0'] = time.monotonic()
+        ax['target'] = target
+        ax['dir'] = direction if target is None else (1 if target > ax['pos'] else -1 if target < ax['pos'] else 0)
+
+
+    def _io(self, nBytes):
+        self.nCommands += 1
+        time.sleep(self._rig.serialLatency + nBytes*10/self._rig.serialBaud)
+
+
+    def write(self, line):
+        with self._lock:
+            self.bytesWritten += len(line) + 1
+            self._io(len(line) + 1)
+            self._run(line)
+
+
+    def query(self, line):
+        with self._lock:
+            answer = self._run(line)
+            self.bytesWritten += len(line) + 1
+            self.bytesRead += len(answer) + 1
+            self._io(len(line) + len(answer) + 2)
+            return answer
+
+
+    def close(self):
+        pass
+
+
+    def _run(self, line):
+        answer = ''
+        for cmd in line.split(';'):
+            cmd = cmd.strip()
+            if cmd == '*IDN?':
+                answer = 'ESP300 Version 3.08 SIMULATED'
+                continue
+            m = re.match(r'(\d+)([A-Z]{2})(\??)(.*)', cmd)
+            if not m:
+                continue
+            n, op, isQuery, arg = int(m.group(1)), m.group(2), m.group(3), m.group(4)
+            ax = self._axis(n)
+            if op == 'TP':
+                answer = '{0:.5f}'.format(self.position(n))
+            elif op == 'MD':
+                self.position(n)
+                answer = '1' if ax['dir'] == 0 else '0'
+            elif op in ('VA', 'AC') and isQuery:
+                answer = str(ax['vel'] if op == 'VA' else ax['acc'])
+            elif op == 'VA':
+                ax['vel'] = float(arg)
+            elif op == 'AC':
+                ax['acc'] = float(arg)
+            elif op == 'MO':
+                ax['on'] = True
+            elif op == 'MF':
+                ax['on'] = False
+            elif op == 'DH':
+                ax['pos'] = 0.0 if ax['dir'] == 0 else ax['pos']
+            elif op == 'PA' and ax['on']:
+                self._startMove(ax, n, target=float(arg))
+            elif op == 'PR' and ax['on']:
+                self._startMove(ax, n, target=self.position(n) + float(arg))
+            elif op == 'MV' and ax['on']:
+                self._startMove(ax, n, direction=1 if arg.strip() == '+' else -1)
+            elif op == 'ST':
+                ax['pos'] = self.position(n)
+                ax['dir'] = 0
+        return answer
+
+
+_rig = None
+
+def getRig():
+    '''Simulated rig behind the SIM:: resources, created with the default settings on first use'''
+    global _rig
+    if _rig is None:
+        _rig = SimRig()
+    return _rig
+
+
+def setRig(rig):
+    global _rig
+    _rig = rig
+
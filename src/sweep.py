@@ -0,0 +1,133 @@
+"""
+Speed of sound / geometry sweep of usrt, for calibrating vs and Rs (autofocus).
+
+    python src/sweep.py Mediciones/scan.npz --pt Mediciones/trData.npz --vs 1470 1500 16 --rs 42.4e-3 42.8e-3 9
+
+The sinogram is filtered once: the usrt filter depends on vs only through its
+4/vs**2 gain, so every candidate only repeats the backprojection, and the
+candidates run in a pool of processes.
+vs and Rs are coupled through the delay 2*Rs/vs of the rotation axis: sweep both
+with grids fine enough to follow the ridge of the metric.
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from usrt import createImagegrid2D, filterSinogram, backprojectAngles
+
+
+def sharpness(F, metric:str='l4'):
+    """
+    Focus metric of an image, independent of its scale (higher is sharper).
+    metric: 'l4' (sum(F**4)/sum(F**2)**2, high when the energy gathers in few pixels) or
+            'gradient' (energy of the gradient over the energy of the image, sensitive to noise)
+    """
+    F = np.asarray(F, dtype=np.float64)
+    energy = np.sum(F*F)
+    if energy == 0:
+        return 0.0
+    if metric == 'gradient':
+        gy, gx = np.gradient(F)
+        return float(np.sum(gx*gx + gy*gy)/energy)
+    if metric == 'l4':
+        return float(np.sum(F**4)/energy**2*F.size)
+    raise ValueError("metric must be 'gradient' or 'l4'")
+
+
+_shared = {}
+
+def _initWorker(psi, t, tita, wtita, rj, chunkSize):
+    _shared.update(psi=psi, t=t, tita=tita, wtita=wtita, rj=rj, chunkSize=chunkSize)
+
+
+def _backprojectCandidate(vs, Rs):
+    s = _shared
+    return backprojectAngles(s['psi'], s['t'], s['tita'], s['wtita'], s['rj'], vs, Rs, s['chunkSize'])/np.float32(vs*vs)
+
+
+def sweepParameters(sino, pt, t, Snoise, hfrec, vsValues, RsValues, nx, dx, arc=360, workers=None, metric='l4', chunkSize=1<<21):
+    """
+    usrt of every (vs, Rs) pair of the grids.
+    vsValues: candidate speeds of sound [nVs,], m/s
+    RsValues: candidate distances between the transducer and the rotation axis [nRs,], m
+    workers: number of processes (os.cpu_count() by default, 1 runs in this process)
+    metric: see sharpness
+    The rest of the arguments are those of usrt.
+    Returns (images [nVs, nRs, nx, nx], metrics [nVs, nRs]); the images are those of usrt
+    """
+    vsValues = np.atleast_1d(np.asarray(vsValues, dtype=float))
+    RsValues = np.atleast_1d(np.asarray(RsValues, dtype=float))
+    t = np.asarray(t).astype(np.float32)
+    Na = sino.shape[0]
+    tita = (np.linspace(0,arc*np.pi/180,Na+1)[0:-1]).astype(np.float32)
+    wtita = np.full(Na, (arc/Na)*np.pi/180, dtype=np.float32)
+    rj = createImagegrid2D(nx,dx)
+    psi = filterSinogram(sino, pt, t, Snoise, hfrec, 1.0)    # gain 4/vs**2 applied per candidate
+
+    pairs = [(vs, Rs) for vs in vsValues for Rs in RsValues]
+    args = (psi, t, tita, wtita, rj, chunkSize)
+    workers = os.cpu_count() if workers is None else workers
+    if workers == 1:
+        _initWorker(*args)
+        images = [_backprojectCandidate(vs, Rs) for vs, Rs in pairs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_initWorker, initargs=args) as executor:
+            images = list(executor.map(_backprojectCandidate, *zip(*pairs)))
+
+    images = np.array(images).reshape(len(vsValues), len(RsValues), nx, nx)
+    metrics = np.array([sharpness(F, metric) for F in images.reshape(-1, nx, nx)]).reshape(len(vsValues), len(RsValues))
+    return images, metrics
+
+
+def bestParameters(vsValues, RsValues, metrics):
+    '''(vs, Rs) of the sharpest image'''
+    i, j = np.unravel_index(np.argmax(metrics), metrics.shape)
+    return float(np.atleast_1d(vsValues)[i]), float(np.atleast_1d(RsValues)[j])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sinogram', help='.npz with tAxis and Sinogram, as saved by the Tomography Routine')
+    parser.add_argument('--pt', required=True, help='.npz with the transducer impulse response')
+    parser.add_argument('--pt-key', default='A', help='key of the impulse response in --pt (default: A)')
+    parser.add_argument('--vs', type=float, nargs=3, metavar=('START', 'STOP', 'NUM'), help='grid of speeds of sound, m/s')
+    parser.add_argument('--temp', type=float, help='center the vs grid on vela9mac(TEMP) instead, °C')
+    parser.add_argument('--vs-span', type=float, default=20, help='half width of the vs grid with --temp, m/s')
+    parser.add_argument('--vs-num', type=int, default=11, help='points of the vs grid with --temp')
+    parser.add_argument('--rs', type=float, nargs=3, metavar=('START', 'STOP', 'NUM'), default=[42.625e-3, 42.625e-3, 1],
+                        help='grid of transducer distances, m')
+    parser.add_argument('--snoise', type=float, default=0.1e-4)
+    parser.add_argument('--hfrec', type=float, default=5e6)
+    parser.add_argument('--arc', type=float, default=360)
+    parser.add_argument('--nx', type=int, default=128)
+    parser.add_argument('--dx', type=float, default=0.08e-3)
+    parser.add_argument('--metric', default='l4', choices=('l4', 'gradient'))
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--out', help='.npz where the images, metrics and grids are saved')
+    args = parser.parse_args(argv)
+
+    if args.temp is not None:
+        from utils import vela9mac
+        v0 = vela9mac(args.temp)
+        vsValues = np.linspace(v0 - args.vs_span, v0 + args.vs_span, args.vs_num)
+    elif args.vs is not None:
+        vsValues = np.linspace(args.vs[0], args.vs[1], int(args.vs[2]))
+    else:
+        parser.error("give --vs or --temp")
+    RsValues = np.linspace(args.rs[0], args.rs[1], int(args.rs[2]))
+
+    data = np.load(args.sinogram)
+    pt = np.load(args.pt)[args.pt_key]
+    images, metrics = sweepParameters(data['Sinogram'], pt, data['tAxis'], args.snoise, args.hfrec, vsValues, RsValues,
+                                      args.nx, args.dx, args.arc, args.workers, args.metric)
+    for i, vs in enumerate(vsValues):
+        print(" ".join("vs={0:8.2f} Rs={1:.5e} {2:.5g}".format(vs, Rs, metrics[i, j]) for j, Rs in enumerate(RsValues)))
+    vs, Rs = bestParameters(vsValues, RsValues, metrics)
+    print("Sharpest: vs = {0:.2f} m/s, Rs = {1:.5e} m".format(vs, Rs))
+    if args.out:
+        np.savez(args.out, images=images, metrics=metrics, vs=vsValues, Rs=RsValues)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+import json
+import os
+import re
+import threading
+import time
+
+
+class Tracer(object):
+    '''Timeline of a scan: instrument commands, sleeps and compute phases
+
+    Usage:
+        with tracing.Tracer() as tracer:
+            ...open the instruments and scan...
+        tracer.printSummary()
+        tracer.saveChromeTrace("scan.trace.json")    #chrome://tracing or ui.perfetto.dev
+    Sessions opened while a tracer is enabled are traced until they are closed.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        self._threads = {}
+        self.events = []
+
+
+    def __enter__(self):
+        enable(self)
+        return self
+
+
+    def __exit__(self, excType, excValue, traceback):
+        disable()
+
+
+    def record(self, name:str, cat:str, start:float, dur:float, **args):
+        """
+        Adds an event.
+        name: event name (e.g. the command header)
+        cat: category: "usb", "serial", "sleep", "compute", ...
+        start: time.perf_counter() at the start, s
+        dur: duration, s
+        args: extra values shown in the trace viewer (bytes, command, ...)
+        """
+        tid = threading.get_ident()
+        with self._lock:
+            if tid not in self._threads:
+                self._threads[tid] = threading.current_thread().name
+            self.events.append((name, cat, start, dur, tid, args))
+
+
+    def span(self, name:str, cat:str='compute', **args):
+        return _Span(self, name, cat, args)
+
+
+    def summary(self):
+        '''{(cat, name): {'count', 'total', 'mean', 'max', 'bytes'}} (times in s), plus the wall time under ('all', 'wall')'''
+        with self._lock:
+            events = list(self.events)
+        out = {}
+        for name, cat, start, dur, tid, args in events:
+            s = out.setdefault((cat, name), {'count': 0, 'total': 0.0, 'max': 0.0, 'bytes': 0})
+            s['count'] += 1
+            s['total'] += dur
+            s['max'] = max(s['max'], dur)
+            s['bytes'] += args.get('bytes', 0)
+        for s in out.values():
+            s['mean'] = s['total']/s['count']
+        if events:
+            wall = max(e[2] + e[3] for e in events) - min(e[2] for e in events)
+            out[('all', 'wall')] = {'count': len(events), 'total': wall, 'mean': wall, 'max': wall, 'bytes': 0}
+        return out
+
+
+    def printSummary(self, top:int=20):
+        summary = self.summary()
+        wall = summary.pop(('all', 'wall'), {'total': 0.0})['total']
+        totals = {}
+        for (cat, name), s in summary.items():
+            t = totals.setdefault(cat, [0, 0.0, 0])
+            t[0] += s['count']; t[1] += s['total']; t[2] += s['bytes']
+        print("Wall time: {0:.3f} s".format(wall))
+        for cat, (count, total, nBytes) in sorted(totals.items(), key=lambda x: -x[1][1]):
+            print("  {0:<10} {1:7d} events {2:9.3f} s {3:11d} bytes".format(cat, count, total, nBytes))
+        print("{0:<10} {1:<28} {2:>7} {3:>9} {4:>10} {5:>11}".format("cat", "name", "count", "total s", "mean ms", "bytes"))
+        for (cat, name), s in sorted(summary.items(), key=lambda x: -x[1]['total'])[:top]:
+            print("{0:<10} {1:<28} {2:7d} {3:9.3f} {4:10.3f} {5:11d}".format(
+                cat, name[:28], s['count'], s['total'], 1e3*s['mean'], s['bytes']))
+
+
+    def saveChromeTrace(self, path:str):
+        '''Saves the events in the Chrome trace event format (chrome://tracing, ui.perfetto.dev)'''
+        pid = os.getpid()
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self._threads)
+        trace = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                 for tid, name in threads.items()]
+        for name, cat, start, dur, tid, args in events:
+            trace.append({'name': name, 'cat': cat, 'ph': 'X', 'pid': pid, 'tid': tid,
+                          'ts': 1e6*(start - self._t0), 'dur': 1e6*dur, 'args': args})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f, default=str)
+
+
+class _Span(object):
+
+    def __init__(self, tracer, name, cat, args):
+        self._tracer = tracer
+        self._name = name
+        self._cat = cat
+        self._args = args
+
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, excType, excValue, traceback):
+        self._tracer.record(self._name, self._cat, self._start, time.perf_counter() - self._start, **self._args)
+
+
+class _NoSpan(object):
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, excType, excValue, traceback):
+        pass
+
+
+class TracedResource(object):
+    '''Instrument session (pyvisa resource or simulated instrument) that records every command in a Tracer'''
+
+    def __init__(self, resource, tracer, cat:str):
+        object.__setattr__(self, '_resource', resource)
+        object.__setattr__(self, '_tracer', tracer)
+        object.__setattr__(self, '_cat', cat)
+
+
+    def __getattr__(self, name):
+        return getattr(self._resource, name)
+
+
+    def __setattr__(self, name, value):
+        setattr(self._resource, name, value)     #baud_rate, read_termination, ... belong to the session
+
+
+    def _call(self, method, cmd, *args, **kwargs):
+        start = time.perf_counter()
+        answer = getattr(self._resource, method)(cmd, *args, **kwargs)
+        dur = time.perf_counter() - start
+        if answer is None or isinstance(answer, int):        #write returns the number of bytes written
+            received = 0
+        elif isinstance(answer, str):
+            received = len(answer)
+        elif hasattr(answer, 'nbytes'):
+            received = int(answer.nbytes)
+        else:
+            received = len(';'.join(str(v) for v in answer))
+        self._tracer.record(commandHeader(cmd), self._cat, start, dur, cmd=cmd, bytes=len(cmd) + 1 + received)
+        return answer
+
+
+    def write(self, cmd, *args, **kwargs):
+        return self._call('write', cmd, *args, **kwargs)
+
+
+    def query(self, cmd, *args, **kwargs):
+        return self._call('query', cmd, *args, **kwargs)
+
+
+    def query_ascii_values(self, cmd, *args, **kwargs):
+        return self._call('query_ascii_values', cmd, *args, **kwargs)
+
+
+    def query_binary_values(self, cmd, *args, **kwargs):
+        return self._call('query_binary_values', cmd, *args, **kwargs)
+
+
+def commandHeader(cmd:str):
+    '''Command without axis number nor arguments, used to group the statistics: "2PA10;2MD?" -> "PA;MD?", "CH1:SCA 0.5" -> "CH1:SCA"'''
+    pieces = []
+    for piece in cmd.strip().strip(';').split(';'):
+        piece = piece.strip().split(' ', 1)[0]
+        piece = re.sub(r'^\d+', '', piece)
+        pieces.append(re.sub(r'[-+\d.]+$', '', piece) or piece)
+    return ';'.join(pieces)
+
+
+_tracer = None
+_noSpan = _NoSpan()
+
+
+def enable(tracer:Tracer=None):
+    '''Starts tracing into tracer (a new Tracer by default) and returns it'''
+    global _tracer
+    _tracer = Tracer() if tracer is None else tracer
+    return _tracer
+
+
+def disable():
+    '''Stops tracing and returns the tracer that was enabled'''
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def getTracer():
+    return _tracer
+
+
+def span(name:str, cat:str='compute', **args):
+    '''Context manager timing a phase. A shared no-op object when tracing is disabled.'''
+    if _tracer is None:
+        return _noSpan
+    return _tracer.span(name, cat, **args)
+
+
+def sleep(seconds:float, name:str='sleep'):
+    '''time.sleep that is recorded while tracing'''
+    if _tracer is None:
+        time.sleep(seconds)
+        return
+    start = time.perf_counter()
+    time.sleep(seconds)
+    _tracer.record(name, 'sleep', start, time.perf_counter() - start, requested=seconds)
+
+
+def wrap(resource, cat:str):
+    '''Session traced under cat when tracing is enabled, the session itself otherwise'''
+    if _tracer is None:
+        return resource
+    return TracedResource(resource, _tracer, cat)
@@ -1,103 +1,410 @@
-import numpy as np
-from matplotlib import pyplot as plt
-from tqdm import tqdm
-from IPython.display import clear_output
-
-
-###############################################################################
-def createImagegrid2D(nx,dx):
-    N = int(nx*nx)
-    x = np.linspace(-nx*dx/2,nx*dx/2,nx)
-    y = np.linspace(-nx*dx/2,nx*dx/2,nx)
-    xv, yv = np.meshgrid(x,y,indexing='xy')
-    rj = np.zeros((2,N)) # pixel position [rj]=(2,N))
-    rj[0,:] = xv.ravel()
-    rj[1,:] = yv.ravel()
-    rj = rj.astype(np.float32)
-    return rj
-
-###############################################################################
-def plotResults(F, nx, dx):
-    img = np.reshape(F,(nx,nx))
-    fig, ax = plt.subplots(1, 3, figsize=(26, 5.5), gridspec_kw={"width_ratios": [1,1,1]})
-
-    mainPlt = ax[0].imshow(img)
-    fig.colorbar(mainPlt, ax=ax[0])
-    ax[0].set_xlabel('x [pixel]')
-    ax[0].set_ylabel('y [pixel]')
-
-    ax[1].plot(np.arange(-nx//2,nx//2)*dx*1e3,img[nx//2,:])
-    ax[1].grid()
-    ax[1].set_xlabel('x [mm]')
-    ax[1].set_ylabel('Amplitude (a.u.)')
-
-    img2 = np.copy(img)
-    img2[img2<0]=0
-    mm=nx//2*dx*1e3
-    secPlt = ax[2].imshow(img2, extent=(-mm, mm, -mm, mm), cmap="gray")
-    fig.colorbar(secPlt, ax=ax[2])
-    ax[2].set_xlabel('x [mm]')
-    ax[2].set_ylabel('y [mm]')
-    ax[2].grid()
-    clear_output(wait=True)
-    plt.show()
-
-###############################################################################
-def usrt(sino,pt,t,Snoise,hfrec,vs,nx,dx,Rs,arc, plot):
-    """
-    pt: transducer time singnal
-    sino: sinograma  [Na, Nt]
-    t: time axis [Nt,]
-    Snoise: std of measured noise
-    hfrec: value of the frequency of the ideal filter response, Hz
-    vs: speed of sound of the medium, m/s
-    nx = number of pixels per side of the image grid
-    dx = size of the pixel, m
-    Rs: distance between the transducer and the rotation axis of the sample
-    arc: circunference arc [°]
-    plot: plot results? True or False
-    """
-
-    t = t.astype(np.float32)
-    pt = pt.astype(np.float32)
-    sino = sino.astype(np.float32)
-
-    Na, Nt = sino.shape
-    dt = (t[1]-t[0])                          # s
-    Fs = 1/dt                                 #[Hz]
-    frec = np.arange(Nt)/Nt*Fs                # Hz [Nt, ]
-    f = frec-Fs/2                             # Hz [Nt, ]
-    w = 2*np.pi*f                             # 1/s [Nt, ]
-    tita = np.linspace(0,arc*np.pi/180,Na+1)  # rad [Na, ]
-    tita = tita[0:-1]
-    dtita = (arc/Na)*np.pi/180                # rad
-    N = nx*nx                                 # total number of pixels
-
-    tita = tita.astype(np.float32)
-    frec = frec.astype(np.float32)
-    f = f.astype(np.float32)
-    w = w.astype(np.float32)
-
-    Ptf = np.fft.fftshift(np.fft.fft(pt)/Nt)  # [Nt,]
-
-    Hw = np.abs(w) # [Nt,]
-    Hw = np.where(Hw > 2*np.pi*hfrec, Hw*0, Hw*1) # [Nt,]
-    #Hw = Hw*np.hamming(Nt)
-
-    rj = createImagegrid2D(nx,dx)             # [2,N]
-    rj = rj.astype(np.float32)
-    F = np.zeros(rj.shape[1])                 # [2,N]
-    F = F.astype(np.float32)
-    for i2 in tqdm(range(0,Na)):
-        Prf = np.fft.fftshift(np.fft.fft(sino[i2,:])/Nt)
-        Sw = Prf*np.conjugate(Ptf)/(np.abs(Ptf)**2 + Snoise**2)
-        Psi = Hw * Sw
-        psi = 4/vs**2*np.fft.ifft(np.fft.ifftshift(Psi))
-        rsx = Rs*np.cos(tita[i2]); rsy = Rs*np.sin(tita[i2])
-        for i1 in range(0,N):
-            ta = 2/vs*((rsx-rj[0,i1])*np.cos(tita[i2])+(rsy-rj[1,i1])*np.sin(tita[i2]))
-            F[i1] = F[i1] + np.interp(ta, t, np.real(psi)) * dtita
-        if plot:
-          plotResults(F, nx, dx)
-
-    return np.reshape(F,(nx,nx))
\ No newline at end of file
+import bisect
+import hashlib
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from preview import Preview
+import backends
+import tracing
+
+
+###############################################################################
+def createImagegrid2D(nx,dx):
+    N = int(nx*nx)
+    x = np.linspace(-nx*dx/2,nx*dx/2,nx)
+    y = np.linspace(-nx*dx/2,nx*dx/2,nx)
+    xv, yv = np.meshgrid(x,y,indexing='xy')
+    rj = np.zeros((2,N)) # pixel position [rj]=(2,N))
+    rj[0,:] = xv.ravel()
+    rj[1,:] = yv.ravel()
+    rj = rj.astype(np.float32)
+    return rj
+
+###############################################################################
+def createRectGrid(nx, ny, dx, x0=0, y0=0):
+    """
+    Rectangular grid of nx*ny pixels spaced dx, centered at (x0, y0), with the
+    same layout as createImagegrid2D (row-major, [ny, nx] once reshaped).
+    """
+    x = x0 + (np.arange(nx) - (nx-1)/2)*dx
+    y = y0 + (np.arange(ny) - (ny-1)/2)*dx
+    xv, yv = np.meshgrid(x,y,indexing='xy')
+    rj = np.zeros((2,nx*ny)) # pixel position [rj]=(2,N))
+    rj[0,:] = xv.ravel()
+    rj[1,:] = yv.ravel()
+    rj = rj.astype(np.float32)
+    return rj
+
+###############################################################################
+def plotResults(F, nx, dx):
+    plt = backends.pyplot()
+    img = np.reshape(F,(nx,nx))
+    fig, ax = plt.subplots(1, 3, figsize=(26, 5.5), gridspec_kw={"width_ratios": [1,1,1]})
+
+    mainPlt = ax[0].imshow(img)
+    fig.colorbar(mainPlt, ax=ax[0])
+    ax[0].set_xlabel('x [pixel]')
+    ax[0].set_ylabel('y [pixel]')
+
+    ax[1].plot(np.arange(-nx//2,nx//2)*dx*1e3,img[nx//2,:])
+    ax[1].grid()
+    ax[1].set_xlabel('x [mm]')
+    ax[1].set_ylabel('Amplitude (a.u.)')
+
+    img2 = np.copy(img)
+    img2[img2<0]=0
+    mm=nx//2*dx*1e3
+    secPlt = ax[2].imshow(img2, extent=(-mm, mm, -mm, mm), cmap="gray")
+    fig.colorbar(secPlt, ax=ax[2])
+    ax[2].set_xlabel('x [mm]')
+    ax[2].set_ylabel('y [mm]')
+    ax[2].grid()
+    backends.clearOutput(wait=True)
+    plt.show()
+
+###############################################################################
+def interpTable(t, tita, rj, vs, Rs):
+    """
+    Linear interpolation table of the delays ta of the pixels rj for each angle.
+    t: uniform time axis [Nt,]
+    tita: angles [Na,], rad
+    rj: pixel positions [2, N]
+    Returns (i0, frac), both [Na, N]: psi(ta) = (1-frac)*psi[i0] + frac*psi[i0+1]
+    """
+    Nt = len(t)
+    t0 = float(t[0])
+    dt = (float(t[-1]) - t0)/(Nt-1)          # s, the time axis is uniform
+
+    # ta = 2/vs*(Rs - x*cos(tita) - y*sin(tita)), expressed in samples of t
+    tita = np.asarray(tita, dtype=np.float64)[:, None]
+    a0 = np.float32((2*Rs/vs - t0)/dt)
+    kx = (2/(vs*dt)*np.cos(tita)).astype(np.float32)
+    ky = (2/(vs*dt)*np.sin(tita)).astype(np.float32)
+    x = rj[0].astype(np.float32)
+    y = rj[1].astype(np.float32)
+    pos = a0 - kx*x - ky*y                    # [Na, N]
+    np.clip(pos, 0, Nt-1, out=pos)            # same edge values as np.interp
+    i0 = pos.astype(np.int32)
+    np.minimum(i0, Nt-2, out=i0)
+    pos -= i0
+    return i0, pos
+
+###############################################################################
+def backprojectAngles(psi, t, tita, wtita, rj, vs, Rs, chunkSize=1<<21):
+    """
+    Vectorized delay-and-sum backprojection of filtered signals.
+    psi: filtered signals [Na, Nt]
+    t: uniform time axis [Nt,]
+    tita: angle of each row of psi [Na,], rad
+    wtita: angular weight of each row of psi [Na,], rad
+    rj: pixel positions [2, N]
+    vs: speed of sound of the medium, m/s
+    Rs: distance between the transducer and the rotation axis of the sample
+    chunkSize: max number of (angle, pixel) delays evaluated at once
+    Returns the contribution of the given angles to the image [N,]
+    """
+    psi = np.ascontiguousarray(psi, dtype=np.float32)
+    Na, Nt = psi.shape
+    N = rj.shape[1]
+    wtita = np.asarray(wtita, dtype=np.float32)
+    rowOffset = (np.arange(Na, dtype=np.int64)*Nt)[:, None]
+    psiFlat = psi.ravel()
+
+    F = np.zeros(N, dtype=np.float32)
+    nPix = max(1, chunkSize//Na)
+    for j0 in range(0, N, nPix):
+        i0, frac = interpTable(t, tita, rj[:, j0:j0+nPix], vs, Rs)
+        i0 = i0 + rowOffset
+        v0 = psiFlat[i0]
+        val = v0 + frac*(psiFlat[i0+1] - v0)
+        F[j0:j0+nPix] = wtita @ val
+    return F
+
+###############################################################################
+def backproject(psi, t, tita, wtita, rj, vs, Rs, workers=1, pool='thread', angleBlock=8, chunkSize=1<<21, onBlock=None):
+    """
+    Backprojection of all the rows of psi, split in blocks of angleBlock angles.
+    Each block gives a partial image and the partials are added in block order,
+    so the result is the same for any number of workers.
+    workers: number of threads or processes sharing the blocks
+    pool: 'thread' or 'process'
+    onBlock: called as onBlock(F, nAngles) each time a block is added to F
+    The rest of the arguments are those of backprojectAngles.
+    """
+    Na = psi.shape[0]
+    blocks = [slice(a0, min(a0+angleBlock, Na)) for a0 in range(0, Na, angleBlock)]
+    args = ([psi[b] for b in blocks], [t]*len(blocks), [tita[b] for b in blocks], [wtita[b] for b in blocks],
+            [rj]*len(blocks), [vs]*len(blocks), [Rs]*len(blocks), [chunkSize]*len(blocks))
+
+    def reduceBlocks(partials):
+        F = np.zeros(rj.shape[1], dtype=np.float32)
+        for blk, Fb in zip(blocks, partials):
+            F += Fb
+            if onBlock is not None:
+                onBlock(F, blk.stop - blk.start)
+        return F
+
+    if workers == 1:
+        with tracing.span('backproject', angles=Na, pixels=rj.shape[1]):
+            return reduceBlocks(map(backprojectAngles, *args))
+    if pool == 'thread':
+        executor = ThreadPoolExecutor(max_workers=workers)
+    elif pool == 'process':
+        executor = ProcessPoolExecutor(max_workers=workers)
+    else:
+        raise ValueError("pool must be 'thread' or 'process'")
+    with tracing.span('backproject', angles=Na, pixels=rj.shape[1], workers=workers), executor:
+        return reduceBlocks(executor.map(backprojectAngles, *args))  # map keeps the block order
+
+###############################################################################
+_kernelCache = {}
+_kernelCacheSize = 16
+
+def wienerKernel(pt, t, Snoise, hfrec, vs, ramp=True):
+    """
+    Wiener deconvolution and ideal ramp filter of usrt, as a real-FFT kernel.
+    Applying it with irfft(rfft(p)*kernel, Nt) gives the real part of the
+    filtered signal psi. Kernels are cached by (pt, t, Snoise, hfrec, vs, ramp).
+    pt: transducer time singnal [Nt,]
+    t: time axis [Nt,]
+    ramp: False leaves out the 4/vs**2*|w| ramp: only the deconvolution and the
+          ideal low pass at hfrec (data of the iterative reconstructions)
+    Returns the kernel [Nt//2+1,] complex64
+    """
+    t = np.asarray(t, dtype=np.float32)
+    pt = np.asarray(pt, dtype=np.float32)
+    key = (hashlib.sha1(pt.tobytes()).hexdigest(), len(t), float(t[1]-t[0]), float(Snoise), float(hfrec), float(vs), bool(ramp))
+    if key in _kernelCache:
+        return _kernelCache[key]
+
+    Nt = len(t)
+    dt = (t[1]-t[0])                          # s
+    Fs = 1/dt                                 #[Hz]
+    frec = np.arange(Nt)/Nt*Fs                # Hz [Nt, ]
+    f = frec-Fs/2                             # Hz [Nt, ]
+    w = 2*np.pi*f                             # 1/s [Nt, ]
+    w = w.astype(np.float32)
+
+    Hw = np.abs(w) # [Nt,]
+    Hw = np.where(Hw > 2*np.pi*hfrec, Hw*0, Hw*1) # [Nt,]
+    #Hw = Hw*np.hamming(Nt)
+    gain = 4/vs**2
+    if not ramp:
+        Hw = (np.abs(w) <= 2*np.pi*hfrec).astype(np.float32)
+        gain = 1
+
+    Ptf = np.fft.fft(pt.astype(np.float64))/Nt                    # [Nt,]
+    K = gain*np.fft.ifftshift(Hw)*np.conjugate(Ptf)/(np.abs(Ptf)**2 + Snoise**2)/Nt
+    # only the hermitian part of K contributes to the real part of psi
+    Kh = (K + np.conjugate(np.roll(K[::-1], 1)))/2
+    kernel = Kh[:Nt//2+1].astype(np.complex64)
+
+    if len(_kernelCache) >= _kernelCacheSize:
+        _kernelCache.pop(next(iter(_kernelCache)))
+    _kernelCache[key] = kernel
+    return kernel
+
+###############################################################################
+def filterSinogram(sino, pt, t, Snoise, hfrec, vs, chunkRows=256, scales=None, ramp=True):
+    """
+    Deconvolution/filtering stage of usrt, done as a batched real FFT in float32.
+    sino: sinograma  [Na, Nt]
+    chunkRows: number of rows transformed at once
+    scales: optional (yze, ymu, yoff), each [Na,], when sino holds raw scope codes
+            (e.g. a memory map from MeasStore.getSinogramView). Rows are converted
+            to volts chunk by chunk, without a full copy of the sinogram
+    ramp: see wienerKernel
+    The rest of the arguments are those of usrt.
+    Returns the filtered sinogram psi [Na, Nt] float32, ready for backproject
+    """
+    Na, Nt = sino.shape
+    with tracing.span('filterSinogram', angles=Na, samples=Nt):
+        kernel = wienerKernel(pt, t, Snoise, hfrec, vs, ramp)
+        psi = np.empty((Na, Nt), dtype=np.float32)
+        for r0 in range(0, Na, chunkRows):
+            rows = np.asarray(sino[r0:r0+chunkRows], dtype=np.float32)
+            if scales is not None:
+                yze, ymu, yoff = (np.asarray(x, dtype=np.float32)[r0:r0+chunkRows, None] for x in scales)
+                rows = (rows - yoff)*ymu + yze
+            psi[r0:r0+chunkRows] = np.fft.irfft(np.fft.rfft(rows, axis=1)*kernel, Nt, axis=1)
+    return psi
+
+###############################################################################
+def usrt(sino,pt,t,Snoise,hfrec,vs,nx,dx,Rs,arc, plot, workers=1, pool='thread', angleBlock=8, chunkSize=1<<21, rj=None, shape=None, scales=None, progress=True):
+    """
+    pt: transducer time singnal
+    sino: sinograma  [Na, Nt]
+    t: time axis [Nt,]
+    Snoise: std of measured noise
+    hfrec: value of the frequency of the ideal filter response, Hz
+    vs: speed of sound of the medium, m/s
+    nx = number of pixels per side of the image grid
+    dx = size of the pixel, m
+    Rs: distance between the transducer and the rotation axis of the sample
+    arc: circunference arc [°]
+    plot: plot results? True, False or a preview.Preview. True shows a
+          decimated preview at most every 2 s and the full image at the end
+    workers: number of threads or processes used for the backprojection
+    pool: 'thread' or 'process'
+    angleBlock: number of angles backprojected together
+    chunkSize: max number of (angle, pixel) delays evaluated at once
+    rj: optional pixel positions [2,N] (e.g. from createRectGrid) instead of
+        the nx*nx centered grid. plot is then only used for square shapes
+    shape: shape of the returned image when rj is given, (N,) by default
+    scales: (yze, ymu, yoff) per angle when sino holds raw scope codes (see filterSinogram)
+    progress: show a tqdm progress bar (off for batch workers)
+    """
+
+    t = t.astype(np.float32)
+
+    Na, Nt = sino.shape
+    tita = np.linspace(0,arc*np.pi/180,Na+1)  # rad [Na, ]
+    tita = tita[0:-1]
+    dtita = (arc/Na)*np.pi/180                # rad
+    tita = tita.astype(np.float32)
+
+    psi = filterSinogram(sino, pt, t, Snoise, hfrec, vs, scales=scales)   # [Na, Nt]
+
+    if rj is None:
+        rj = createImagegrid2D(nx,dx)         # [2,N]
+        shape = (nx,nx)
+    elif shape is None:
+        shape = (rj.shape[1],)
+    if len(shape) != 2 or shape[0] != shape[1]:
+        plot = False
+    else:
+        nx = shape[0]
+    wtita = np.full(Na, dtita, dtype=np.float32)
+    preview = Preview(nx, dx, render=plotResults) if plot is True else plot
+    with backends.progressBar(Na, progress) as pbar:
+        def onBlock(F, nAngles):
+            pbar.update(nAngles)
+            if preview:
+                preview.update(F, nAngles)
+        F = backproject(psi, t, tita, wtita, rj, vs, Rs, workers, pool, angleBlock, chunkSize, onBlock)
+    if preview:
+        with tracing.span('preview.close'):
+            preview.close(F)
+
+    return np.reshape(F,shape)
+
+###############################################################################
+def usrtCoarseToFine(sino,pt,t,Snoise,hfrec,vs,nx,dx,Rs,arc, factor=4, tile=16, threshold=0.1, ny=None, x0=0, y0=0, workers=1):
+    """
+    Two-level usrt: the image is first reconstructed with pixels factor times
+    larger, then only the tile*tile pixel tiles where the coarse image reaches
+    threshold*max(|coarse|) are reconstructed at full resolution. The rest of
+    the image keeps the upsampled coarse values.
+    nx, ny: size of the fine grid in pixels (ny = nx by default), multiples of factor
+    x0, y0: center of the grid, m
+    The rest of the arguments are those of usrt.
+    Returns (image [ny, nx], mask [ny, nx] of the refined pixels)
+    """
+    ny = nx if ny is None else ny
+    t = t.astype(np.float32)
+    Na = sino.shape[0]
+    tita = (np.linspace(0,arc*np.pi/180,Na+1)[0:-1]).astype(np.float32)
+    wtita = np.full(Na, (arc/Na)*np.pi/180, dtype=np.float32)
+    psi = filterSinogram(sino, pt, t, Snoise, hfrec, vs)
+
+    rjc = createRectGrid(nx//factor, ny//factor, dx*factor, x0, y0)
+    Fc = backproject(psi, t, tita, wtita, rjc, vs, Rs, workers)
+    img = np.kron(np.reshape(Fc, (ny//factor, nx//factor)), np.ones((factor, factor), dtype=np.float32))
+
+    # tiles of the fine grid, flagged from the coarse pixels they cover
+    level = np.abs(img) >= threshold*np.max(np.abs(Fc))
+    mask = np.zeros((ny, nx), dtype=bool)
+    for i in range(0, ny, tile):
+        for j in range(0, nx, tile):
+            if level[i:i+tile, j:j+tile].any():
+                mask[i:i+tile, j:j+tile] = True
+
+    rj = createRectGrid(nx, ny, dx, x0, y0)[:, mask.ravel()]
+    if rj.shape[1]:
+        img[mask] = backproject(psi, t, tita, wtita, rj, vs, Rs, workers)
+    return img, mask
+
+###############################################################################
+class UsrtStream(object):
+    '''Incremental usrt reconstruction, fed one angle at a time while the scan runs'''
+
+    def __init__(self, pt, t, Snoise, hfrec, vs, nx, dx, Rs, arc=360, Na=None):
+        """
+        Na: number of angles of a uniform scan. Each angle then weighs arc/Na,
+            as in usrt, whatever the order in which they arrive.
+            If None, the angles may be non-uniform and each one weighs the gap
+            to the next angle pushed (rectangle rule over the arc).
+        The rest of the arguments are those of usrt.
+        """
+        self._pt = np.asarray(pt, dtype=np.float32)
+        self._t = np.asarray(t, dtype=np.float32)
+        self._Snoise = Snoise
+        self._hfrec = hfrec
+        self._vs = vs
+        self._nx = nx
+        self._dx = dx
+        self._Rs = Rs
+        self._arc = arc
+        self._Na = Na
+        self._rj = createImagegrid2D(nx,dx)
+        self.reset()
+
+
+    def reset(self):
+        self._F = np.zeros(self._rj.shape[1], dtype=np.float32)
+        self._angles = []          # sorted angles pushed so far, °
+        self._psi = {}             # filtered trace of each angle
+        self._lastBp = (None, None)
+
+
+    def push(self, angle:float, trace):
+        """
+        angle: measurement angle, °
+        trace: signal [Nt,], or the array returned by Osctck (time axis in row 0)
+        """
+        trace = np.asarray(trace)
+        if trace.ndim == 2:
+            trace = trace[1]
+        psi = filterSinogram(trace[None, :], self._pt, self._t, self._Snoise, self._hfrec, self._vs)
+        bp = self._backproject(angle, psi)
+
+        if self._Na is not None:
+            self._F += bp*np.float32((self._arc/self._Na)*np.pi/180)
+            self._angles.append(angle)
+            return
+
+        if angle in self._psi:
+            raise ValueError("Angle {0}° was already pushed".format(angle))
+        k = bisect.bisect(self._angles, angle)
+        if self._angles:
+            pred = self._angles[k-1]
+            succ = self._angles[k] if k < len(self._angles) else self._angles[0]
+            wPred = (angle - pred) % self._arc
+            wOld = (succ - pred) % self._arc if len(self._angles) > 1 else self._arc
+            wNew = (succ - angle) % self._arc
+            self._F += self._getBackprojection(pred)*np.float32((wPred - wOld)*np.pi/180)
+        else:
+            wNew = self._arc
+        self._F += bp*np.float32(wNew*np.pi/180)
+        self._angles.insert(k, angle)
+        self._psi[angle] = psi
+        self._lastBp = (angle, bp)
+
+
+    def _backproject(self, angle, psi):
+        tita = np.array([angle*np.pi/180], dtype=np.float32)
+        return backprojectAngles(psi, self._t, tita, np.ones(1), self._rj, self._vs, self._Rs)
+
+
+    def _getBackprojection(self, angle):
+        # In an ordered scan the angle to reweight is the last one pushed
+        if self._lastBp[0] == angle:
+            return self._lastBp[1]
+        return self._backproject(angle, self._psi[angle])
+
+
+    def getAngles(self):
+        return list(self._angles)
+
+
+    def getImage(self):
+        return np.reshape(self._F, (self._nx, self._nx)).copy()
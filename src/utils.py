@@ -1,18 +1,24 @@
-import matplotlib.pyplot as plt
 import os
+import logging
 from datetime import date
 import numpy as np
 import math as mt
+from measStore import MeasStore
+from catalog import MeasCatalog
+import backends
+import quicklook
+
+
+log = logging.getLogger(__name__)
 
 
 def plotSignalInTxt(path):
-    meas = np.loadtxt(path, dtype = float)
-    step = meas[1,0] - meas[0,0]
-    y = meas[:,1]
-    #x = meas[:,0]
-    #x = np.arange(0, len(y), 1)
-    x = np.arange(0, len(y)*step, step)[0:len(y)]
-    plt.plot(x, y, label = path.split("/")[-1].replace(".txt", ""))
+    """Adds the trace of the file to the current plot. The file is parsed once (see quicklook.TraceCache)
+    and drawn as a min/max envelope sized to the axes, re-decimated when zooming."""
+    plt = backends.pyplot()
+    view = quicklook.getView()
+    view.addTrace(path)
+    x = view.ax.get_lines()[-1].get_xdata()
     plt.xlim([x[0], x[len(x)-1]])
     #plt.xlabel("Muestras [n]", fontsize=14)
     plt.xlabel("Tiempo [s]", fontsize=14)
@@ -27,13 +33,10 @@ def plotSignalInTxt(path):
     
     
 def plotSignalNormInTxt(path):
-    meas = np.loadtxt(path, dtype = float)
-    step = meas[1,0] - meas[0,0]
-    y = meas[:,1]
-    #x = meas[:,0]
-    #x = np.arange(0, len(y), 1)
-    x = np.arange(0, len(y)*step, step)[0:len(y)]
-    plt.plot(x, y/ np.max(y), label = path.split("/")[-1].replace(".txt", ""))
+    plt = backends.pyplot()
+    view = quicklook.getView()
+    view.addTrace(path, normalize=True)
+    x = view.ax.get_lines()[-1].get_xdata()
     plt.xlim([x[0], x[len(x)-1]])
     #plt.xlabel("Muestras [n]", fontsize=14)
     plt.xlabel("Tiempo [s]", fontsize=14)
@@ -48,19 +51,9 @@ def plotSignalNormInTxt(path):
 
 
 def plotFFTfromTxt(txtpath):
-    meas = np.loadtxt(txtpath, dtype = float)
-    x = meas[:,0]
-    y = meas[:,1]
-
-    N = len(x)
-    T = x[1]-x[0]
-    y_f = np.fft.fft(y)
-    x_f = np.linspace(0, 1/(2*T), N//2)
-    
-    Y = np.abs(y_f[:N//2])
-    Y = Y / np.max(Y[1:])
-
-    plt.semilogx(x_f, Y, label = txtpath.split("/")[-1].replace(".txt", ""))
+    """Adds the normalized spectrum of the file to the current plot (the FFT is cached with the trace)"""
+    plt = backends.pyplot()
+    quicklook.getView().addSpectrum(txtpath, normalize=True)
     plt.xlabel("Frecuencia [Hz]")
     plt.grid(True, which="both", ls="-")
     
@@ -70,27 +63,24 @@ def plotFFTfromTxt(txtpath):
 
 
 def plotSignalFFTtxt(txtPath):
-    meas = np.loadtxt(txtPath, dtype = float)
-    x = meas[:,0]
-    y = meas[:,1]    
-    N = len(x)
-    T = x[1]-x[0]
-    y_f = np.fft.fft(y)
-    x_f = np.linspace(0, 1/(2*T), N//2)
-
-    plt.figure(txtPath.split("/")[-1].replace(".txt", ""))
+    plt = backends.pyplot()
+    name = quicklook.traceLabel(txtPath)
+
+    plt.figure(name)
     plt.subplot(121)
-    plt.plot(x,y,"g-")
+    view = quicklook.getView()
+    view.addTrace(txtPath, relative=False, color="g")
+    x = view.ax.get_lines()[-1].get_xdata()
     plt.xlim([x[0], x[len(x)-1]])
-    plt.title(txtPath.split("/")[-1].replace(".txt", ""), fontsize=14)
+    plt.title(name, fontsize=14)
     plt.xlabel("Tiempo [s]")
     plt.ylabel("Amplitud [V]")
     plt.grid(True, which="both", ls="--")
     plt.minorticks_on()     
     
     plt.subplot(122)
-    plt.semilogx(x_f, 2/N * np.abs(y_f[:N//2]))
-    plt.title(txtPath.split("/")[-1].replace(".txt", "") + " (FFT)", fontsize=14)
+    quicklook.getView().addSpectrum(txtPath, normalize=False)
+    plt.title(name + " (FFT)", fontsize=14)
     plt.xlabel("Frecuencia [Hz]")
     plt.grid(True, which="both", ls="-")
     plt.ion()
@@ -123,6 +113,8 @@ def getFilesList():
     pathsList = []
 
     for x in folderPaths:
+        if x.startswith(".") or not os.path.isdir("Mediciones/" + x):     #The catalog and loose files
+            continue
         listFiles = os.listdir("Mediciones/" + x)
         for y in listFiles:
             pathsList.append("Mediciones/" + x + "/" + y)
@@ -148,8 +140,31 @@ def getDirectory():
     return directory 
 
 
-def saveAngleMeas(folderName, angle, meas):
-    
+_catalog = None
+
+
+def getCatalog():
+    """Catalog of the Mediciones folder (see catalog.MeasCatalog), opened on first use"""
+    global _catalog
+    if _catalog is None:
+        _catalog = MeasCatalog("Mediciones")
+    return _catalog
+
+
+def _addToCatalog(path, **fields):
+    '''Adds a saved measurement to the catalog. A catalog error (locked or read-only
+    database, ...) is logged and does not stop the scan: getCatalog().reindex() adds it later.'''
+    try:
+        getCatalog().add(path, **fields)
+    except Exception:
+        log.exception("Could not add %s to the catalog", path)
+
+
+def saveAngleMeas(folderName, angle, meas, **metadata):
+    """
+    Saves the measurement [t, V] of one angle as text and adds it to the catalog.
+    metadata: optional catalog fields, e.g. temperature, triggerSource, triggerLevel, acquisition
+    """
     dirPath = getDirectory() + "/" + folderName
     
     if not os.path.exists(dirPath): 
@@ -159,6 +174,16 @@ def saveAngleMeas(folderName, angle, meas):
     txtHeader = "[{0}]    [{1}]".format("seg.", "V")
     measArray = np.column_stack((meas[0], meas[1]))      
     np.savetxt(txtPath, measArray, fmt='%.12f', header = txtHeader)
+    _addToCatalog(txtPath, angle=angle, **metadata)
+
+
+def openMeasStore(folderName):
+    """
+    Binary store of a scan in today's measurement folder (see measStore.MeasStore).
+    Use store.append(angle, osc.acquireRaw()) instead of saveAngleMeas to keep the
+    raw scope codes without the text conversion. Each append updates the catalog.
+    """
+    return MeasStore(getDirectory() + "/" + folderName + ".meas", onAppend=_addToCatalog)
     
 
 def vela9mac(T):